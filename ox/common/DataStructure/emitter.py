@@ -10,6 +10,9 @@ from ox.common.IR.graph_pb2 import ModelDef, NodeDef, GraphDef, DataType
 
 class Emitter(object):
 
+    # registered pass names run on the IR graph, see ox.rewriter.pass_manager
+    passes = list()
+
     def __init__(self):
         self.body_code = str()
         self.weights_dict = dict()
@@ -48,6 +51,28 @@ class Emitter(object):
     def _build(self):
         self.IR_graph.build()
 
+    def _get_passes(self, passes=None, fold_batchnorm=False):
+        """The passes to run, the class default when passes is None.
+
+        fold_batchnorm adds the BatchNorm folding before fuse_activations, which only fuses
+        an activation reading the Conv directly.
+        """
+        passes = list(self.passes if passes is None else passes)
+        if fold_batchnorm and not 'fold_batchnorm' in passes:
+            following = [name for name in ('fuse_activations', 'infer_shapes', 'fold_scopes') if name in passes]
+            passes.insert(passes.index(following[0]) if following else len(passes), 'fold_batchnorm')
+        return passes
+
+    def _plan_memory(self):
+        """Generate the code in the topological order with the lowest peak activation memory."""
+        from ox.common.IR.memory_planner import MemoryPlanner
+        from ox.common.utils import sizeof_fmt
+        planner = MemoryPlanner(self.IR_graph)
+        peak = planner.simulate()[0]
+        self.IR_graph.topological_sort = planner.plan()
+        print("Planned the execution order, peak activation memory was [{}].".format(sizeof_fmt(peak)))
+        planner.report(self.IR_graph.topological_sort)
+
     def gen_code(self, phase):
         raise NotImplementedError("do not use base emitter class.")
 
@@ -27,11 +27,94 @@ class GraphNode(object):
     def __str__(self):
         return self.real_variable_name
 
+class LayerMap(collections.OrderedDict):
+    """OrderedDict of layer name --> node, indexed by node type.
+
+    The index is updated when a node is inserted or deleted. A node whose type
+    changes in place has to be stored again (or reindex called) to move it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._type_index = dict()   # type --> {name : insertion number}
+        self._order = dict()        # name --> (type, insertion number)
+        self._counter = 0
+        super(LayerMap, self).__init__(*args, **kwargs)
+
+
+    def __setitem__(self, name, node):
+        if name in self._order:
+            node_type, order = self._order[name]
+            del self._type_index[node_type][name]
+        else:
+            order = self._counter
+            self._counter += 1
+        node_type = getattr(node, 'type', None)
+        self._type_index.setdefault(node_type, dict())[name] = order
+        self._order[name] = (node_type, order)
+        super(LayerMap, self).__setitem__(name, node)
+
+
+    def __delitem__(self, name):
+        super(LayerMap, self).__delitem__(name)
+        node_type, _ = self._order.pop(name)
+        del self._type_index[node_type][name]
+
+
+    # the dict methods below may bypass __setitem__ and __delitem__, they go through them here
+
+    def pop(self, name, *default):
+        if name in self:
+            node = self[name]
+            del self[name]
+            return node
+        if default:
+            return default[0]
+        raise KeyError(name)
+
+
+    def popitem(self, last = True):
+        if not self:
+            raise KeyError('dictionary is empty')
+        name = next(reversed(self)) if last else next(iter(self))
+        return name, self.pop(name)
+
+
+    def clear(self):
+        super(LayerMap, self).clear()
+        self._type_index.clear()
+        self._order.clear()
+
+
+    def setdefault(self, name, default = None):
+        if not name in self:
+            self[name] = default
+        return self[name]
+
+
+    def update(self, *args, **kwargs):
+        for name, node in collections.OrderedDict(*args, **kwargs).items():
+            self[name] = node
+
+
+    def reindex(self, name = None):
+        for key in ([name] if name else list(self.keys())):
+            self[key] = self[key]
+
+
+    def get_names_by_type(self, node_types):
+        """Names of the nodes of any of node_types, in insertion order."""
+        if len(node_types) == 1:
+            index = self._type_index.get(node_types[0], dict())
+            return sorted(index, key = index.get)
+        names = [(order, name) for node_type in node_types for name, order in self._type_index.get(node_type, dict()).items()]
+        return [name for _, name in sorted(names)]
+
+
 class Graph(object):
 
     def __init__(self, model):
         # key: layer_name    value: keras layer
-        self.layer_map = collections.OrderedDict()
+        self.layer_map = LayerMap()
         self.input_layers = list()
         self.output_layers = list()
         self.layer_name_map = collections.OrderedDict()
@@ -86,6 +169,13 @@ class Graph(object):
         return self.layer_map.values()
 
 
+    def get_nodes_by_type(self, node_types):
+        """Nodes whose type is one of node_types ('A|B' or a list), in graph order."""
+        if isinstance(node_types, str):
+            node_types = node_types.split('|')
+        return [self.layer_map[name] for name in self.layer_map.get_names_by_type(node_types)]
+
+
     def get_son(self, name, path, set_flag = False):
         if name == None: return None
         current_node = self.get_node(name)
@@ -3,6 +3,7 @@
 #  Licensed under the MIT License. See License.txt in the project root for license information.
 #----------------------------------------------------------------------------------------------
 
+import pickle
 import numpy as np
 import ox.common.IR.graph_pb2 as graph_pb2
 from ox.common.IR.graph_pb2 import ModelDef, NodeDef, GraphDef, DataType
@@ -21,6 +22,9 @@ info_model = {
 
 class Parser(object):
 
+    # registered pass names run on the source graph, see ox.rewriter.pass_manager
+    passes = list()
+
     def __init__(self):
         self.IR_model = ModelDef()
         self._add_model_info()
@@ -96,8 +100,14 @@ class Parser(object):
 
     def save_weights(self, filename):
         if self.weight_loaded:
+            # Same layout as np.save of the dict, but the pickle is streamed into
+            # the file instead of being built in memory first. With protocol 5
+            # contiguous arrays are written straight from their buffers.
+            container = np.empty((), dtype = object)
+            container[()] = self.weights
             with open(filename, 'wb') as of:
-                np.save(of, self.weights)
+                np.lib.format.write_array_header_1_0(of, np.lib.format.header_data_from_array_1_0(container))
+                pickle.dump(container, of, protocol = min(pickle.HIGHEST_PROTOCOL, 5))
             print ("IR weights are saved as [{}].".format(filename))
 
         else:
@@ -6,7 +6,7 @@
 import ox.common.IR.graph_pb2 as graph_pb2
 from ox.common.utils import *
 from ox.common.IR.graph_pb2 import TensorShape, AttrValue
-from ox.common.DataStructure.graph import Graph, GraphNode
+from ox.common.DataStructure.graph import Graph, GraphNode, LayerMap
 
 
 def load_protobuf_from_file(container, filename):
@@ -93,11 +93,13 @@ class IRGraph(Graph):
         # model = graph_pb2.GraphDef()
         load_protobuf_from_file(model_all, filename)
         model = model_all.graph
+        # source framework, its conventions show through in shapes and axis attrs
+        self.framework_name = model_all.framework_name
         super(IRGraph, self).__init__(model)
 
 
     def filter_node(self):
-        self.layer_map = dict(filter(lambda layer: layer[1].in_edges or layer[1].out_edges, self.layer_map.items()))
+        self.layer_map = LayerMap(filter(lambda layer: layer[1].in_edges or layer[1].out_edges, self.layer_map.items()))
 
 
     def build(self):
@@ -123,6 +125,56 @@ class IRGraph(Graph):
         self.input_layers = list(filter(lambda x: self.layer_map[x].type != 'Constant', self.input_layers))
 
 
+    # Graph mutation used by the IR passes. layer_map is authoritative after build,
+    # removed NodeDefs stay in self.model. Call rebuild when done.
+
+    def replace_input(self, node, old_name, new_edge):
+        """Make `node` read `new_edge` wherever it read node `old_name`.
+
+        new_edge is a node name, or a node name with an output index which is
+        then used for every reference to old_name.
+        """
+        for inputs in (node.in_edges, node.layer.input):
+            for idx, name in enumerate(inputs):
+                if name.split(':')[0] == old_name:
+                    inputs[idx] = new_edge if ':' in new_edge else new_edge + name[len(old_name):]
+
+        if old_name in self.layer_map:
+            old_node = self.layer_map[old_name]
+            old_node.out_edges = [name for name in old_node.out_edges if name != node.name]
+        new_node = self.get_node(new_edge)
+        if not node.name in new_node.out_edges:
+            new_node.out_edges.append(node.name)
+
+
+    def bypass_node(self, node, input_idx = 0):
+        """Remove `node`, its consumers read its input_idx-th input instead."""
+        source = node.in_edges[input_idx]
+        for out_node_name in list(node.out_edges):
+            self.replace_input(self.get_node(out_node_name), node.name, source)
+        self.delete_node(node)
+
+
+    def delete_node(self, node):
+        for in_edge in node.in_edges:
+            in_node = self.layer_map.get(in_edge.split(':')[0])
+            if in_node is not None:
+                in_node.out_edges = [name for name in in_node.out_edges if name != node.name]
+
+        for out_node_name in node.out_edges:
+            out_node = self.layer_map.get(out_node_name)
+            if out_node is not None:
+                out_node.in_edges = [name for name in out_node.in_edges if name.split(':')[0] != node.name]
+                kept = [name for name in out_node.layer.input if name.split(':')[0] != node.name]
+                del out_node.layer.input[:]
+                out_node.layer.input.extend(kept)
+
+        node.in_edges = list()
+        node.out_edges = list()
+        del self.layer_map[node.name]
+        self.layer_name_map.pop(node.name, None)
+
+
     def clear_out_scope_node(self):
 
         def _clear_list_out_scope(list_):
@@ -0,0 +1,200 @@
+import numpy as np
+import ox.common.IR.graph_pb2 as graph_pb2
+from ox.common.utils import shape_to_list, sizeof_fmt
+
+
+_dtype_size = {
+    graph_pb2.DT_INT8    : 1,
+    graph_pb2.DT_INT16   : 2,
+    graph_pb2.DT_INT32   : 4,
+    graph_pb2.DT_INT64   : 8,
+    graph_pb2.DT_UINT8   : 1,
+    graph_pb2.DT_UINT16  : 2,
+    graph_pb2.DT_UINT32  : 4,
+    graph_pb2.DT_UINT64  : 8,
+    graph_pb2.DT_FLOAT16 : 2,
+    graph_pb2.DT_FLOAT32 : 4,
+    graph_pb2.DT_FLOAT64 : 8,
+    graph_pb2.DT_BOOL    : 1,
+}
+
+
+class MemoryPlanner(object):
+    """Static activation-memory planner for an IRGraph.
+
+    Every node produces the tensors described by its _output_shapes. A tensor
+    is allocated when its node runs and freed after its last consumer ran,
+    graph outputs are kept to the end. While a node runs, its inputs and its
+    outputs are live together. Constants are weights and cost nothing here.
+
+    Parameters
+    ----------
+    graph: IRGraph
+        A built graph.
+
+    batch_size: int
+        Used for an unknown (-1) first dimension. Other unknown dimensions
+        count as 1 and the sizes are then lower bounds.
+
+    max_states: int
+        Budget of the exact order search, see plan.
+    """
+
+    def __init__(self, graph, batch_size = 1, max_states = 100000):
+        self.graph = graph
+        self.batch_size = batch_size
+        self.max_states = max_states
+        self.partial_shapes = list()
+
+        self.names = [name for name in graph.topological_sort]
+        self.index = dict((name, idx) for idx, name in enumerate(self.names))
+        self.sizes = [self._tensor_size(graph.get_node(name)) for name in self.names]
+
+        self.inputs = list()
+        self.consumers = [0] * len(self.names)
+        for idx, name in enumerate(self.names):
+            inputs = set(self.index[edge.split(':')[0]] for edge in graph.get_node(name).in_edges if edge.split(':')[0] in self.index)
+            self.inputs.append(sorted(inputs))
+            for input_idx in inputs:
+                self.consumers[input_idx] |= 1 << idx
+
+
+    def _tensor_size(self, node):
+        if node.type == 'Constant':
+            return 0
+        item_size = _dtype_size.get(node.get_attr('dtype'), 4)
+        size = 0
+        for shape in node.get_attr('_output_shapes') or list():
+            dims = shape_to_list(shape)
+            if any(dim < 0 for dim in dims[1:]) or shape.unknown_rank:
+                self.partial_shapes.append(node.name)
+            if dims and dims[0] < 0:
+                dims[0] = self.batch_size
+            size += int(np.prod([max(dim, 1) for dim in dims])) * item_size
+        return size
+
+
+    def _is_freed(self, idx, executed):
+        # consumed by every consumer, graph outputs stay alive
+        return self.consumers[idx] and not self.consumers[idx] & ~executed
+
+
+    def simulate(self, order = None):
+        """Return (peak bytes, name of the node running at the peak, live bytes per step) of an order."""
+        order = order or self.names
+        executed = 0
+        live = 0
+        peak = 0
+        peak_node = None
+        steps = list()
+        for name in order:
+            idx = self.index[name]
+            running = live + self.sizes[idx]
+            if running > peak:
+                peak, peak_node = running, name
+            steps.append(running)
+
+            executed |= 1 << idx
+            live = running - sum(self.sizes[i] for i in self.inputs[idx] if self._is_freed(i, executed))
+        return peak, peak_node, steps
+
+
+    def plan(self):
+        """Return a topological order of the node names minimizing the peak memory.
+
+        The search runs over the sets of executed nodes, whose live memory does
+        not depend on the order they ran in, keeping the lowest peak reaching
+        each set. It is exact unless more than max_states sets are visited,
+        in which case the greedy order is returned: always run the ready node
+        leaving the least memory live.
+        """
+        order = self._search()
+        return order if order is not None else self._greedy()
+
+
+    def _ready_after(self, ready, idx, executed):
+        ready = [i for i in ready if i != idx]
+        consumers = self.consumers[idx]
+        while consumers:
+            bit = consumers & -consumers
+            consumers ^= bit
+            node_idx = bit.bit_length() - 1
+            if all(executed >> i & 1 for i in self.inputs[node_idx]):
+                ready.append(node_idx)
+        return ready
+
+
+    def _run(self, executed, live, ready, idx):
+        """Run node idx, then every ready node without activations, which never raises the peak."""
+        ran = list()
+        while idx is not None:
+            executed |= 1 << idx
+            live += self.sizes[idx] - sum(self.sizes[i] for i in self.inputs[idx] if self._is_freed(i, executed))
+            ready = self._ready_after(ready, idx, executed)
+            ran.append(idx)
+            idx = next((i for i in ready if not self.sizes[i]), None)
+        return executed, live, ready, ran
+
+
+    def _initial_state(self):
+        ready = [idx for idx in range(len(self.names)) if not self.inputs[idx]]
+        idx = next((i for i in ready if not self.sizes[i]), None)
+        if idx is None:
+            return 0, 0, ready, list()
+        return self._run(0, 0, ready, idx)
+
+
+    def _search(self):
+        executed, live, ready, ran = self._initial_state()
+        # executed set --> (peak, live, ready nodes)
+        level = {executed : (0, live, ready)}
+        parents = {executed : (None, ran)}
+        visited = 0
+        while level:
+            next_level = dict()
+            for executed, (peak, live, ready) in level.items():
+                for idx in ready:
+                    new_peak = max(peak, live + self.sizes[idx])
+                    new_executed, new_live, new_ready, ran = self._run(executed, live, ready, idx)
+                    if new_executed in next_level and next_level[new_executed][0] <= new_peak:
+                        continue
+                    next_level[new_executed] = (new_peak, new_live, new_ready)
+                    parents[new_executed] = (executed, ran)
+
+            visited += len(next_level)
+            if visited > self.max_states:
+                return None
+            if not next_level:
+                break
+            level = next_level
+
+        # every node ran in the last level
+        executed = next(iter(level))
+        order = list()
+        while executed is not None:
+            executed, ran = parents[executed]
+            order.extend(self.names[idx] for idx in reversed(ran))
+        return order[::-1]
+
+
+    def _greedy(self):
+        executed, live, ready, ran = self._initial_state()
+        order = [self.names[idx] for idx in ran]
+        while ready:
+            idx = min(ready, key = lambda i: (self.sizes[i] - sum(self.sizes[j] for j in self.inputs[i] if self._is_freed(j, executed | 1 << i)), i))
+            executed, live, ready, ran = self._run(executed, live, ready, idx)
+            order.extend(self.names[idx] for idx in ran)
+        return order
+
+
+    def report(self, order = None, top = 10):
+        """Print the peak activation memory of an order and the largest activations."""
+        peak, peak_node, _ = self.simulate(order)
+        print("Peak activation memory [{}] while running [{}].".format(sizeof_fmt(peak), peak_node))
+        heavy = sorted(range(len(self.names)), key = lambda idx: -self.sizes[idx])[:top]
+        for idx in heavy:
+            if self.sizes[idx]:
+                print("    {:<40} {:<20} {}".format(self.names[idx], self.graph.get_node(self.names[idx]).type, sizeof_fmt(self.sizes[idx])))
+        if self.partial_shapes:
+            print("Warning: [{}] nodes have unknown dimensions, counted as 1.".format(len(self.partial_shapes)))
+        return peak
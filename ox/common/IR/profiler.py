@@ -0,0 +1,177 @@
+import json
+import numpy as np
+from ox.common.utils import shape_to_list, sizeof_fmt
+from ox.common.IR.memory_planner import _dtype_size
+
+
+_elementwise_types = set([
+    'Add', 'Sub', 'Mul', 'Div', 'RealDiv', 'Maximum', 'Maxmum', 'Minimum', 'Neg', 'Abs', 'Square',
+    'Sqrt', 'Rsqrt', 'Exp', 'Relu', 'Relu6', 'LeakyRelu', 'PRelu', 'Elu', 'Selu', 'Sigmoid', 'Tanh',
+    'Softplus', 'Scale',
+])
+
+
+def _num_elements(dims):
+    return int(np.prod(dims)) if dims else 1
+
+
+class Profiler(object):
+    """Static cost model of an IRGraph.
+
+    For every node it counts the multiply-accumulates and floating point
+    operations from kernel_shape, strides and _output_shapes, the parameters
+    stored in the weights dict, and the bytes of activations and parameters
+    read and the bytes written. A MAC counts as two FLOPs, elementwise ops
+    one FLOP per output element.
+
+    Parameters
+    ----------
+    graph: IRGraph
+        A built graph.
+
+    weights_dict: dict
+        node name --> weights, as saved by the parsers.
+
+    batch_size: int
+        Used for an unknown (-1) first dimension, other unknown dimensions
+        count as 1.
+    """
+
+    columns = ('name', 'type', 'macs', 'flops', 'params', 'bytes_read', 'bytes_written')
+
+    def __init__(self, graph, weights_dict = None, batch_size = 1):
+        self.graph = graph
+        self.weights_dict = weights_dict or dict()
+        self.batch_size = batch_size
+        self.layers = None
+
+
+    def _output_dims(self, node):
+        ret = list()
+        for shape in node.get_attr('_output_shapes') or list():
+            dims = [dim if dim >= 0 else 1 for dim in shape_to_list(shape)]
+            if dims and shape.dim[0].size < 0:
+                dims[0] = self.batch_size
+            ret.append(dims)
+        return ret
+
+
+    def _input_dims(self, node, output_dims):
+        ret = list()
+        for edge in node.in_edges:
+            name, _, port = edge.partition(':')
+            dims = output_dims.get(name)
+            port = int(port) if port else 0
+            ret.append(dims[port] if dims and port < len(dims) else None)
+        return ret
+
+
+    def _params(self, name):
+        params = 0
+        param_bytes = 0
+        for value in self.weights_dict.get(name, dict()).values():
+            if isinstance(value, np.ndarray):
+                params += value.size
+                param_bytes += value.nbytes
+        return params, param_bytes
+
+
+    def _macs(self, node, input_dims, outputs):
+        out = outputs[0] if outputs else None
+        if out is None:
+            return 0
+        kernel = node.get_attr('kernel_shape')
+
+        if node.type == 'Conv' and kernel:
+            macs = _num_elements(out) * _num_elements(kernel[:-1])
+            group = node.get_attr('group', 1)
+            if group > 1 and input_dims and input_dims[0] and input_dims[0][-1] == kernel[-2]:
+                macs //= group
+            return macs
+        elif node.type == 'DepthwiseConv' and kernel:
+            return _num_elements(out) * _num_elements(kernel[:-2])
+        elif node.type == 'ConvTranspose' and kernel and input_dims and input_dims[-1]:
+            return _num_elements(input_dims[-1][:-1]) * _num_elements(kernel)
+        elif node.type == 'FullyConnected':
+            weights = self.weights_dict.get(node.name, dict()).get('weights')
+            if weights is not None:
+                return _num_elements(out[:-1]) * weights.size
+            if input_dims and input_dims[0]:
+                return out[0] * _num_elements(input_dims[0][1:]) * node.get_attr('units', out[-1])
+        return 0
+
+
+    def _flops(self, node, macs, outputs):
+        if macs:
+            return 2 * macs
+        out = _num_elements(outputs[0]) if outputs else 0
+        if node.type in _elementwise_types:
+            return out
+        elif node.type == 'BatchNorm':
+            return 2 * out
+        elif node.type == 'Softmax':
+            return 3 * out
+        elif node.type == 'Pool':
+            return out * _num_elements(node.get_attr('kernel_shape') or [1])
+        return 0
+
+
+    def profile(self):
+        """Return one dict per node, in topological order, with the keys of Profiler.columns."""
+        output_dims = dict()
+        self.layers = list()
+        for name in self.graph.topological_sort:
+            node = self.graph.get_node(name)
+            outputs = self._output_dims(node)
+            output_dims[name] = outputs
+            input_dims = self._input_dims(node, output_dims)
+
+            item_size = _dtype_size.get(node.get_attr('dtype'), 4)
+            params, param_bytes = self._params(name)
+            macs = self._macs(node, input_dims, outputs)
+            bytes_read = sum(_num_elements(dims) * item_size for dims in input_dims if dims is not None) + param_bytes
+            bytes_written = 0 if node.type == 'Constant' else sum(_num_elements(dims) * item_size for dims in outputs)
+
+            self.layers.append({
+                'name'          : name,
+                'type'          : node.type,
+                'macs'          : macs,
+                'flops'         : self._flops(node, macs, outputs),
+                'params'        : params,
+                'bytes_read'    : bytes_read,
+                'bytes_written' : bytes_written,
+            })
+        return self.layers
+
+
+    def totals(self):
+        layers = self.layers if self.layers is not None else self.profile()
+        ret = dict((key, sum(layer[key] for layer in layers)) for key in self.columns[2:])
+        ret['nodes'] = len(layers)
+        return ret
+
+
+    def table(self, sort_by = 'flops', top = None):
+        """Per-layer table as a string, sorted by one of the numeric columns."""
+        layers = self.layers if self.layers is not None else self.profile()
+        layers = sorted(layers, key = lambda layer: -layer[sort_by])[:top]
+        lines = ["{:<40} {:<16} {:>14} {:>14} {:>12} {:>12} {:>12}".format(*self.columns)]
+        for layer in layers:
+            lines.append("{:<40} {:<16} {:>14,} {:>14,} {:>12,} {:>12} {:>12}".format(
+                layer['name'], layer['type'], layer['macs'], layer['flops'], layer['params'],
+                sizeof_fmt(layer['bytes_read']), sizeof_fmt(layer['bytes_written'])))
+        totals = self.totals()
+        lines.append("Total: {:,} MACs, {:,} FLOPs, {:,} parameters, {} read, {} written.".format(
+            totals['macs'], totals['flops'], totals['params'], sizeof_fmt(totals['bytes_read']), sizeof_fmt(totals['bytes_written'])))
+        return '\n'.join(lines)
+
+
+    def to_json(self, filename = None):
+        """Layers and totals as JSON, written to filename when given."""
+        layers = self.layers if self.layers is not None else self.profile()
+        ret = json.dumps({'layers' : layers, 'totals' : self.totals()}, indent = 2)
+        if filename:
+            with open(filename, 'w') as of:
+                of.write(ret)
+            print("Profile is saved as [{}].".format(filename))
+        return ret
@@ -0,0 +1,439 @@
+import numpy as np
+from ox.common.utils import shape_to_list, list_to_shape
+from ox.rewriter.pass_manager import Pass, register_pass
+
+
+# op type --> rule(node, input shapes, engine) returning the output shapes or None.
+# Shapes are lists of dims in the IR layout (NHWC), -1 for an unknown dim.
+_shape_rules = dict()
+
+
+def _rule(*op_types):
+    def _register(func):
+        for op_type in op_types:
+            _shape_rules[op_type] = func
+        return func
+    return _register
+
+
+def _product(dims):
+    return -1 if any(dim < 0 for dim in dims) else int(np.prod(dims))
+
+
+def _normalize_axis(axis, rank):
+    return axis + rank if axis < 0 else axis
+
+
+@_rule('Relu', 'Relu6', 'LeakyRelu', 'PRelu', 'Elu', 'Selu', 'Sigmoid', 'Tanh', 'Softplus', 'Softmax',
+       'BatchNorm', 'Scale', 'Dropout', 'LRN', 'Identity', 'Cast', 'Abs', 'Neg', 'Exp', 'Sqrt', 'Rsqrt',
+       'Square', 'ZerosLike', 'OnesLike')
+def _same_shape(node, inputs, engine):
+    return [inputs[0]]
+
+
+@_rule('Add', 'Sub', 'Mul', 'Div', 'RealDiv', 'Maximum', 'Maxmum', 'Minimum')
+def _broadcast(node, inputs, engine):
+    rank = max(len(shape) for shape in inputs)
+    ret = list()
+    for axis in range(rank):
+        dims = [shape[axis - rank + len(shape)] for shape in inputs if axis - rank + len(shape) >= 0]
+        known = set(dim for dim in dims if dim != 1)
+        if -1 in known:
+            ret.append(-1 if len(known) == 1 or not known - set([-1]) else max(known))
+        elif len(known) > 1:
+            raise ValueError("Shapes {} cannot be broadcast.".format(inputs))
+        else:
+            ret.append(known.pop() if known else 1)
+    return [ret]
+
+
+@_rule('DataInput')
+def _data_input(node, inputs, engine):
+    if 'shape' in node.layer.attr and not node.layer.attr['shape'].shape.unknown_rank:
+        return [shape_to_list(node.layer.attr['shape'].shape)]
+    return None
+
+
+@_rule('Constant')
+def _constant(node, inputs, engine):
+    value = engine.get_value(node)
+    return None if value is None else [list(value.shape)]
+
+
+def _spatial_output(node, input_shape, kernel, channels):
+    strides = node.get_attr('strides') or [1] * len(input_shape)
+    dilations = node.get_attr('dilations') or [1] * len(input_shape)
+    pads = node.get_attr('pads') or [0] * 2 * len(input_shape)
+    auto_pad = node.get_attr('auto_pad')
+    rank = len(input_shape)
+    ceil_mode = node.get_attr('ceil_mode', False)
+
+    ret = [input_shape[0]]
+    for axis in range(1, rank - 1):
+        size = input_shape[axis]
+        if size < 0:
+            ret.append(-1)
+            continue
+        stride = strides[axis]
+        if auto_pad and auto_pad.startswith('SAME'):
+            ret.append(-(-size // stride))
+            continue
+        effective_kernel = (kernel[axis - 1] - 1) * dilations[axis] + 1
+        padded = size - effective_kernel
+        if auto_pad != 'VALID':
+            padded += pads[axis] + pads[axis + rank]
+        ret.append((-(-padded // stride) if ceil_mode else padded // stride) + 1)
+    ret.append(channels)
+    return ret
+
+
+@_rule('Conv')
+def _conv(node, inputs, engine):
+    kernel = node.get_attr('kernel_shape')
+    if not kernel:
+        return None
+    return [_spatial_output(node, inputs[0], kernel[:-2], kernel[-1])]
+
+
+@_rule('DepthwiseConv')
+def _depthwise_conv(node, inputs, engine):
+    kernel = node.get_attr('kernel_shape')
+    if not kernel:
+        return None
+    return [_spatial_output(node, inputs[0], kernel[:-2], kernel[-2] * kernel[-1])]
+
+
+@_rule('Pool')
+def _pool(node, inputs, engine):
+    if node.get_attr('global_pooling'):
+        return [[inputs[0][0]] + [1] * (len(inputs[0]) - 2) + [inputs[0][-1]]]
+    kernel = node.get_attr('kernel_shape')
+    if not kernel:
+        return None
+    return [_spatial_output(node, inputs[0], kernel[1:-1], inputs[0][-1])]
+
+
+@_rule('FullyConnected')
+def _fully_connected(node, inputs, engine):
+    return [[inputs[0][0], node.get_attr('units')]] if node.get_attr('units') else None
+
+
+@_rule('Flatten')
+def _flatten(node, inputs, engine):
+    return [[inputs[0][0], _product(inputs[0][1:])]]
+
+
+@_rule('Reshape')
+def _reshape(node, inputs, engine):
+    shape = node.get_attr('shape')
+    if not shape and len(inputs) > 1:
+        value = engine.get_input_value(node, 1)
+        shape = value.tolist() if value is not None else None
+    if not shape:
+        return None
+
+    shape = list(shape)
+    total = _product(inputs[0])
+    if shape.count(-1) == 1 and total >= 0:
+        rest = _product([dim for dim in shape if dim != -1])
+        if rest > 0:
+            shape[shape.index(-1)] = total // rest
+    return [shape]
+
+
+@_rule('Transpose')
+def _transpose(node, inputs, engine):
+    perm = node.get_attr('perm')
+    if not perm and len(inputs) > 1:
+        value = engine.get_input_value(node, 1)
+        perm = value.tolist() if value is not None else None
+    if not perm and node.get_attr('perm_list'):
+        # pytorch transpose(dim0, dim1)
+        dims = node.get_attr('perm_list')
+        perm = list(range(len(inputs[0])))
+        perm[dims[0]], perm[dims[1]] = perm[dims[1]], perm[dims[0]]
+    if not perm:
+        return None
+    return [[inputs[0][axis] for axis in perm] + list(inputs[0][len(perm):])]
+
+
+@_rule('Concat')
+def _concat(node, inputs, engine):
+    axis = _normalize_axis(node.get_attr('axis', 0), len(inputs[0]))
+    ret = list(inputs[0])
+    ret[axis] = sum(shape[axis] for shape in inputs) if all(shape[axis] >= 0 for shape in inputs) else -1
+    return [ret]
+
+
+@_rule('Pack')
+def _pack(node, inputs, engine):
+    axis = _normalize_axis(node.get_attr('axis', 0), len(inputs[0]) + 1)
+    ret = list(inputs[0])
+    ret.insert(axis, len(inputs))
+    return [ret]
+
+
+@_rule('Unstack')
+def _unstack(node, inputs, engine):
+    axis = _normalize_axis(node.get_attr('axis', 0), len(inputs[0]))
+    ret = inputs[0][:axis] + inputs[0][axis + 1:]
+    num = node.get_attr('num') or inputs[0][axis]
+    return [list(ret) for _ in range(num)] if num > 0 else None
+
+
+@_rule('Squeeze')
+def _squeeze(node, inputs, engine):
+    axes = [_normalize_axis(axis, len(inputs[0])) for axis in node.get_attr('axes') or list()]
+    if not axes:
+        if -1 in inputs[0]:
+            return None
+        return [[dim for dim in inputs[0] if dim != 1]]
+    return [[dim for axis, dim in enumerate(inputs[0]) if not axis in axes]]
+
+
+@_rule('Unsqueeze')
+def _unsqueeze(node, inputs, engine):
+    ret = list(inputs[0])
+    for axis in node.get_attr('axes') or list():
+        ret.insert(_normalize_axis(axis, len(ret) + 1), 1)
+    return [ret]
+
+
+@_rule('Shape')
+def _shape(node, inputs, engine):
+    return [[len(inputs[0])]]
+
+
+@_rule('Fill')
+def _fill(node, inputs, engine):
+    value = engine.get_input_value(node, 0)
+    return None if value is None else [value.tolist()]
+
+
+@_rule('Pad')
+def _pad(node, inputs, engine):
+    pads = node.get_attr('pads')
+    if not pads:
+        return None
+    rank = len(inputs[0])
+    return [[dim + pads[axis] + pads[axis + rank] if dim >= 0 else -1 for axis, dim in enumerate(inputs[0])]]
+
+
+@_rule('ReduceMean', 'Mean', 'Sum', 'Max', 'Min', 'Prod')
+def _reduce(node, inputs, engine):
+    axes = node.get_attr('axes')
+    if axes is None:
+        return None
+    axes = [_normalize_axis(axis, len(inputs[0])) for axis in axes]
+    if node.get_attr('keepdims', False):
+        return [[1 if axis in axes else dim for axis, dim in enumerate(inputs[0])]]
+    return [[dim for axis, dim in enumerate(inputs[0]) if not axis in axes]]
+
+
+# IR axis of each NCHW axis of a 4-D PyTorch tensor, rank 2 tensors are stored as [N, 1, 1, C]
+_nchw_to_nhwc = [0, 3, 1, 2]
+
+
+def _is_onnx_slice(node):
+    # the pytorch parser keeps the onnx axes, older IR only has the first one in shrink_axis_mask
+    return node.type == 'Slice' and ('axes' in node.layer.attr or 'shrink_axis_mask' in node.layer.attr)
+
+
+def _onnx_slice_axes(node):
+    return node.get_attr('axes') or [node.get_attr('shrink_axis_mask', 0)]
+
+
+@_rule('Slice', 'StridedSlice')
+def _slice(node, inputs, engine):
+    starts = node.get_attr('starts')
+    ends = node.get_attr('ends')
+    if starts is None or ends is None or node.get_attr('ellipsis_mask', 0):
+        return None
+
+    if _is_onnx_slice(node):
+        # pytorch, onnx Slice over NCHW axes, only 4-D IR shapes map back to them
+        if len(inputs[0]) != 4:
+            return None
+        ret = list(inputs[0])
+        for source_axis, start, end in zip(_onnx_slice_axes(node), starts, ends):
+            axis = _nchw_to_nhwc[source_axis]
+            if ret[axis] >= 0:
+                ret[axis] = len(range(*slice(start, end).indices(ret[axis])))
+        return [ret]
+
+    if node.type == 'Slice' and not 'begin_mask' in node.layer.attr:
+        # tf.slice, ends holds the sizes
+        ret = list(inputs[0])
+        for axis, (start, size) in enumerate(zip(starts, ends)):
+            ret[axis] = size if size >= 0 else (ret[axis] - start if ret[axis] >= 0 else -1)
+        return [ret]
+
+    strides = node.get_attr('strides') or [1] * len(starts)
+    begin_mask = node.get_attr('begin_mask', 0)
+    end_mask = node.get_attr('end_mask', 0)
+    shrink_axis_mask = node.get_attr('shrink_axis_mask', 0)
+    new_axis_mask = node.get_attr('new_axis_mask', 0)
+
+    ret = list()
+    axis = 0
+    for i, (start, end, stride) in enumerate(zip(starts, ends, strides)):
+        if new_axis_mask & (1 << i):
+            ret.append(1)
+            continue
+        size = inputs[0][axis]
+        axis += 1
+        if shrink_axis_mask & (1 << i):
+            continue
+        if size < 0:
+            ret.append(-1)
+            continue
+        index = slice(None if begin_mask & (1 << i) else start, None if end_mask & (1 << i) else end, stride)
+        ret.append(len(range(*index.indices(size))))
+    return [ret + list(inputs[0][axis:])]
+
+
+# The pytorch parser records 4-D shapes as NHWC, pads rank 2 to [N, 1, 1, C], leaves a single
+# 0 dim for other ranks and keeps the axis attrs of the source, mostly NCHW. Only the rules
+# below read attrs in the IR convention and keep the rank, the others are skipped there.
+_pytorch_rule_types = set([
+    'DataInput', 'Conv', 'DepthwiseConv', 'Pool', 'Slice',
+    'Relu', 'Relu6', 'LeakyRelu', 'PRelu', 'Elu', 'Selu', 'Sigmoid', 'Tanh', 'Softplus',
+    'BatchNorm', 'Scale', 'Dropout', 'LRN', 'Identity', 'Cast', 'Abs', 'Neg', 'Exp', 'Sqrt', 'Rsqrt',
+    'Square', 'ZerosLike', 'OnesLike', 'Add', 'Sub', 'Mul', 'Div', 'RealDiv', 'Maximum', 'Maxmum', 'Minimum',
+])
+
+
+class ShapeInference(object):
+    """Recomputes the output shapes of an IRGraph from its inputs.
+
+    Nodes are visited in topological order and their shapes are inferred by
+    the rule of their op type from the shapes of their inputs. Where the IR
+    already records a shape of the same rank, the recorded shape is kept and
+    its unknown (-1) dimensions are filled from the inferred one. Disagreements
+    are recorded in self.mismatches as (name, recorded, inferred). Nodes
+    without a rule, or whose inputs have unknown rank, keep their recorded
+    shapes. On graphs from the pytorch parser, only the rules of
+    _pytorch_rule_types run.
+    """
+
+    def __init__(self, graph, weights_dict = None):
+        self.graph = graph
+        self.weights_dict = weights_dict or dict()
+        self.pytorch_layout = getattr(graph, 'framework_name', None) == 'pytorch'
+        self.shapes = dict()
+        self.mismatches = list()
+
+
+    def get_value(self, node):
+        if node.type != 'Constant':
+            return None
+        if node.name in self.weights_dict and 'value' in self.weights_dict[node.name]:
+            return np.asarray(self.weights_dict[node.name]['value'])
+        if 'value' in node.layer.attr and not isinstance(node.get_attr('value'), str):
+            return np.asarray(node.get_attr('value'))
+        return None
+
+
+    def get_input_value(self, node, idx):
+        if len(node.layer.input) <= idx:
+            return None
+        return self.get_value(self.graph.get_node(node.layer.input[idx].split(':')[0]))
+
+
+    def _recorded_shapes(self, node):
+        shapes = node.get_attr('_output_shapes')
+        if not shapes or any(shape.unknown_rank for shape in shapes):
+            return None
+        shapes = [shape_to_list(shape) for shape in shapes]
+        if self.pytorch_layout and any(0 in shape for shape in shapes):
+            # rank the pytorch parser could not convert
+            return None
+        return shapes
+
+
+    def _input_shapes(self, node):
+        # layer.input keeps repeated inputs, in_edges does not
+        ret = list()
+        for edge in node.layer.input:
+            name, _, port = edge.partition(':')
+            shapes = self.shapes.get(name)
+            port = int(port) if port else 0
+            if not shapes or port >= len(shapes):
+                return None
+            ret.append(shapes[port])
+        return ret
+
+
+    def _merge(self, name, recorded, inferred):
+        if recorded is None:
+            return inferred
+        if inferred is None:
+            return recorded
+
+        ret = list()
+        for recorded_shape, inferred_shape in zip(recorded, inferred):
+            if len(recorded_shape) != len(inferred_shape):
+                self.mismatches.append((name, recorded_shape, inferred_shape))
+                ret.append(recorded_shape)
+                continue
+            if any(dim >= 0 and recorded_dim >= 0 and dim != recorded_dim for dim, recorded_dim in zip(inferred_shape, recorded_shape)):
+                self.mismatches.append((name, recorded_shape, inferred_shape))
+            ret.append([inferred_dim if recorded_dim < 0 else recorded_dim for recorded_dim, inferred_dim in zip(recorded_shape, inferred_shape)])
+        return ret + recorded[len(ret):]
+
+
+    def infer(self):
+        """Return node name --> list of output shapes."""
+        self.shapes = dict()
+        self.mismatches = list()
+        for name in self.graph.topological_sort:
+            node = self.graph.get_node(name)
+            inferred = None
+            rule = _shape_rules.get(node.type)
+            if self.pytorch_layout and not node.type in _pytorch_rule_types:
+                rule = None
+            if rule is not None:
+                inputs = self._input_shapes(node)
+                if inputs is not None and (inputs or not node.layer.input):
+                    try:
+                        inferred = rule(node, inputs, self)
+                    except (ValueError, IndexError, TypeError, ZeroDivisionError) as e:
+                        print("Warning: shape of node [{}] of type [{}] cannot be inferred: {}".format(name, node.type, e))
+
+            self.shapes[name] = self._merge(name, self._recorded_shapes(node), inferred)
+        return self.shapes
+
+
+    def apply(self):
+        """Infer the shapes and write them to _output_shapes. Return the names of the updated nodes."""
+        updated = list()
+        for name, shapes in self.infer().items():
+            if shapes is None:
+                continue
+            node = self.graph.get_node(name)
+            recorded = self._recorded_shapes(node)
+            if recorded == shapes or (recorded is None and self.pytorch_layout and node.get_attr('_output_shapes')):
+                continue
+            del node.layer.attr['_output_shapes'].list.shape[:]
+            node.layer.attr['_output_shapes'].list.shape.extend([list_to_shape(shape) for shape in shapes])
+            updated.append(name)
+        return updated
+
+
+@register_pass('infer_shapes')
+class ShapeInferencePass(Pass):
+    """Runs ShapeInference over the graph and reports the shapes it updated or disagrees with.
+
+    Options
+    -------
+    verbose: bool, default False
+        Print every disagreement with the recorded shapes.
+    """
+
+    def run(self, graph, weights_dict):
+        engine = ShapeInference(graph, weights_dict)
+        updated = engine.apply()
+        print("Inferred shapes of [{}] nodes, [{}] disagree with the recorded shapes.".format(len(updated), len(engine.mismatches)))
+        if self.options.get('verbose', False):
+            for name, recorded, inferred in engine.mismatches:
+                print("    {}: recorded {}, inferred {}".format(name, recorded, inferred))
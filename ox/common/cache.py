@@ -0,0 +1,85 @@
+import os
+import hashlib
+import tempfile
+
+
+class DiskCache(object):
+    """Size-bounded on-disk cache of serialized blobs.
+
+    Entries are plain files named by their key. Reading an entry refreshes its
+    modification time, and once the directory grows beyond max_size the least
+    recently used entries are removed first.
+    """
+
+    suffix = '.cache'
+
+    def __init__(self, cache_dir, max_size = 4 * 1024 ** 3):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+
+    @staticmethod
+    def hash_file(filename, block_size = 1 << 20):
+        sha1 = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+
+    @staticmethod
+    def make_key(*parts):
+        sha1 = hashlib.sha1()
+        for part in parts:
+            sha1.update(repr(part).encode('utf-8'))
+            sha1.update(b'\0')
+        return sha1.hexdigest()
+
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+
+        os.utime(path, None)
+        return data
+
+
+    def put(self, key, data):
+        fd, tmp_path = tempfile.mkstemp(dir = self.cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, self._path(key))
+        self._evict()
+
+
+    def _evict(self):
+        entries = list()
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(entry[1] for entry in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
@@ -4,7 +4,9 @@
 #----------------------------------------------------------------------------------------------
 
 import os
+import re
 import numpy as np
+from collections import defaultdict
 from six import string_types as _string_types
 from ox.common.IR.IR_graph import IRGraph, IRGraphNode
 import ox.common.IR.graph_pb2 as graph_pb2
@@ -12,9 +14,33 @@ from ox.common.IR.graph_pb2 import NodeDef, GraphDef, DataType
 from ox.common.DataStructure.emitter import Emitter
 from ox.common.utils import *
 from ox.rewriter.folder import Folder
+from ox.rewriter.pass_manager import PassManager
+
+
+_string_re = re.compile(r"'[^'\\]*(?:\\.[^'\\]*)*'|\"[^\"\\]*(?:\\.[^\"\\]*)*\"")
+_name_re = re.compile(r"(?<![\w.])([A-Za-z_]\w*)")
+_assign_re = re.compile(r"^([A-Za-z_]\w*(?:\s*,\s*[A-Za-z_]\w*)*)\s*=(?!=)")
+
 
 class PytorchEmitter(Emitter):
 
+    # IR passes run before the code is generated, infer_shapes after the rewrites so the
+    # emitter reads shapes of the rewritten graph
+    passes = ['fold_constants', 'eliminate_transposes', 'eliminate_common_subexpressions', 'eliminate_dead_nodes',
+              'fuse_activations', 'infer_shapes', 'fold_scopes']
+
+    # delete the locals of forward() after their last use, so intermediate tensors are freed early
+    release_variables = True
+
+    # in-place activations for the fused_activation attr of Conv, DepthwiseConv and FullyConnected
+    fused_activation_map = {
+        'Relu'    : "F.relu({}, inplace = True)",
+        'Relu6'   : "F.relu6({}, inplace = True)",
+        'Elu'     : "F.elu({}, inplace = True)",
+        'Sigmoid' : "torch.sigmoid_({})",
+        'Tanh'    : "torch.tanh_({})",
+    }
+
     dtype_map = {
         graph_pb2.DT_FLOAT16 : "torch.float16",
         graph_pb2.DT_FLOAT32 : "torch.float32",
@@ -27,7 +53,7 @@ class PytorchEmitter(Emitter):
     }
 
     # Base Functions
-    def __init__(self, model):
+    def __init__(self, model, passes = None, plan_memory = False, trace_memory = False, fold_batchnorm = False):
         super(PytorchEmitter, self).__init__()
         if isinstance(model, _string_types):
             network_path = model
@@ -40,12 +66,17 @@ class PytorchEmitter(Emitter):
         self.IR_graph.build()
         self._load_weights(weight_path)
 
-        folder = Folder(self.IR_graph, self.weights_dict)
-        folder.fold()
+        self.pass_manager = PassManager(self._get_passes(passes, fold_batchnorm), trace_memory = trace_memory)
+        self.pass_manager.run(self.IR_graph, self.weights_dict)
+        self.pass_manager.report()
+        if plan_memory:
+            self._plan_memory()
 
     def run(self, dstNetworkPath, dstWeightPath = None, phase = 'test'):
+        if self.pass_manager.weights_changed and not dstWeightPath:
+            raise ValueError("IR passes changed the weights, give a weight path to save them and load the converted model with it.")
         super(PytorchEmitter, self).run(dstNetworkPath, dstWeightPath, phase)
-        if self.weight_loaded:
+        if self.weight_loaded or self.pass_manager.weights_changed:
             self.save_weights(self.weights_dict, dstWeightPath)
 
 
@@ -95,7 +126,12 @@ class KitModel(nn.Module):
         __weights_dict = load_weights(weight_file)
 """)
 
-        self.add_body(1, "def forward(self, x):")
+        # one forward argument per DataInput, a single input keeps the name x
+        data_inputs = [self.IR_graph.get_node(name) for name in self.IR_graph.input_layers if self.IR_graph.get_node(name).type == 'DataInput']
+        if len(data_inputs) == 1:
+            data_inputs[0].real_name = 'x'
+        self.add_body(1, "def forward(self, {}):".format(', '.join(node.real_variable_name for node in data_inputs)))
+        forward_start = len(self.body_code)
 
         for layer in self.IR_graph.topological_sort:
             # print(layer)
@@ -112,8 +148,13 @@ class KitModel(nn.Module):
                 print("Pytorch Emitter has not supported operator [%s]." % (node_type))
                 self.emit_UNKNOWN(current_node)
 
-        self.add_body(2, "return {}".format(
-            ', '.join([self.IR_graph.get_node(name).real_variable_name for name in self.IR_graph.output_layers if self.IR_graph.get_node(name).type != 'Pack'])))
+        outputs = [self.IR_graph.get_node(name).real_variable_name for name in self.IR_graph.output_layers if self.IR_graph.get_node(name).type != 'Pack']
+        if self.release_variables:
+            lines = self.body_code[forward_start:].splitlines()
+            lines = self._release_dead_variables(lines, [node.real_variable_name for node in data_inputs], outputs)
+            self.body_code = self.body_code[:forward_start] + ''.join(line + '\n' for line in lines)
+
+        self.add_body(2, "return {}".format(', '.join(outputs)))
 
         self.add_body(0, "")
         for i in self.used_layers:
@@ -127,6 +168,57 @@ class KitModel(nn.Module):
         return self.header_code + '\n' + self.init_code + '\n' + self.body_code
 
 
+    @staticmethod
+    def _release_dead_variables(lines, arguments, outputs):
+        """Liveness over the statements of forward(), in topological order.
+
+        A `del` of every local is inserted after the last statement reading or
+        writing it, outputs excepted. The lines are returned unchanged if
+        forward() has nested blocks.
+        """
+        indent = "    " * 2
+        statements = list()
+        current = list()
+        depth = 0
+        for line in lines:
+            current.append(line)
+            code = _string_re.sub("''", line).split('#')[0]
+            depth += sum(code.count(c) for c in '([{') - sum(code.count(c) for c in ')]}')
+            if depth <= 0:
+                statements.append(current)
+                current = list()
+                depth = 0
+        if current:
+            statements.append(current)
+
+        local_names = set(arguments)
+        last_use = dict()
+        for idx, statement in enumerate(statements):
+            if not statement[0].strip():
+                continue
+            if not statement[0].startswith(indent) or statement[0][len(indent)].isspace() or statement[-1].rstrip().endswith(':'):
+                return lines
+
+            code = ' '.join(_string_re.sub("''", line).split('#')[0] for line in statement).strip()
+            target = _assign_re.match(code)
+            if target:
+                local_names.update(name.strip() for name in target.group(1).split(','))
+            for name in _name_re.findall(code):
+                last_use[name] = idx
+
+        releases = defaultdict(list)
+        for name in local_names:
+            if name in last_use and not name in outputs:
+                releases[last_use[name]].append(name)
+
+        ret = list()
+        for idx, statement in enumerate(statements):
+            ret.extend(statement)
+            if idx in releases:
+                ret.append(indent + "del " + ', '.join(sorted(releases[idx])))
+        return ret
+
+
     def _defuse_padding(self, IR_node, extra_str = ""):
         input_node = self.parent_variable_name(IR_node)
         if IR_node.get_attr('auto_pad') == 'VALID':
@@ -147,6 +239,13 @@ class KitModel(nn.Module):
         return input_node
 
 
+    def _fuse_activation(self, IR_node, code):
+        activation = IR_node.get_attr('fused_activation')
+        if activation is None:
+            return code
+        return self.fused_activation_map[activation].format(code)
+
+
     def emit_Conv(self, IR_node):
         self.used_layers.add('Conv')
 
@@ -178,10 +277,9 @@ class KitModel(nn.Module):
 
         input_node = self._defuse_padding(IR_node)
 
-        code = "{:<15} = self.{}({})".format(
-            IR_node.variable_name,
+        code = "{:<15} = {}".format(
             IR_node.variable_name,
-            input_node)
+            self._fuse_activation(IR_node, "self.{}({})".format(IR_node.variable_name, input_node)))
 
         if self.weight_loaded:
             if IR_node.type == 'DepthwiseConv':
@@ -319,8 +417,8 @@ class KitModel(nn.Module):
 
 
     def emit_DataInput(self, IR_node):
-        # Ignore it in Pytorch
-        IR_node.real_name = 'x'
+        # Ignore it in Pytorch, inputs are the forward arguments
+        pass
 
 
     def emit_Dropout(self, IR_node):
@@ -364,10 +462,9 @@ class KitModel(nn.Module):
         if len(self.IR_graph.get_parent(IR_node.name, [0]).get_attr('_output_shapes')[0].dim) > 2:
             input_node = "{}.view({}.size(0), -1)".format(input_node, input_node)
         
-        code = "{:<15} = self.{}({})".format(
-            IR_node.variable_name,
+        code = "{:<15} = {}".format(
             IR_node.variable_name,
-            input_node)
+            self._fuse_activation(IR_node, "self.{}({})".format(IR_node.variable_name, input_node)))
 
         if self.weight_loaded:
             self.check_if_need_transpose(IR_node)
@@ -487,7 +584,19 @@ class KitModel(nn.Module):
 
 
     def emit_LSTM(self, IR_node):
-        return self.emit_RNNs(IR_node, "LSTM")
+        self.used_layers.add('LSTM')
+        self.add_init(2, "self.{} = self.__lstm(name='{}', input_size={}, hidden_size={}, bias={})".format(
+            IR_node.variable_name,
+            IR_node.name,
+            IR_node.get_attr('input_size'),
+            IR_node.get_attr('hidden_size'),
+            IR_node.get_attr('use_bias')))
+
+        code = "{:<15}, _ = self.{}({})".format(
+            IR_node.variable_name,
+            IR_node.variable_name,
+            self.parent_variable_name(IR_node))
+        return code
 
 
     def emit_GRU(self, IR_node):
@@ -959,6 +1068,19 @@ class KitModel(nn.Module):
         """)
 
 
+    def _layer_LSTM(self):
+        self.add_body(0, """
+    @staticmethod
+    def __lstm(name, **kwargs):
+        layer = nn.LSTM(**kwargs)
+        layer.state_dict()['weight_ih_l0'].copy_(torch.from_numpy(__weights_dict[name]['weights_ih']))
+        layer.state_dict()['weight_hh_l0'].copy_(torch.from_numpy(__weights_dict[name]['weights_hh']))
+        if 'bias_ih' in __weights_dict[name]:
+            layer.state_dict()['bias_ih_l0'].copy_(torch.from_numpy(__weights_dict[name]['bias_ih']))
+            layer.state_dict()['bias_hh_l0'].copy_(torch.from_numpy(__weights_dict[name]['bias_hh']))
+        return layer""")
+
+
     def _layer_Conv(self):
         self.add_body(0, """
     @staticmethod
@@ -15,6 +15,33 @@ import re
 
 DYNAMIC_SHAPE_MARK = "Dynamic"
 
+
+def _make_node_name(scope_name, node_id):
+    name = scope_name + node_id
+    # Scopes created in a nested scope may have initial characters
+    # that are illegal as the initial character of an op name
+    # (viz. '-', '\', '/', and '_').
+    return name.replace('-','n').replace('\\','n').replace('/','n').replace('_','n').replace('[','n').replace(']','n')
+
+
+def _get_node_id(node):
+    # a node is identified by the unique id of its first output
+    for output in node.outputs():
+        return str(output.unique())
+    return None
+
+
+def _get_output_shape(node):
+    for output in node.outputs():
+        try:
+            return list(output.type().sizes())
+        except (AttributeError, RuntimeError):
+            # RNN or other control flow related node has
+            # Changable output shape so it is undefined
+            return DYNAMIC_SHAPE_MARK
+    return DYNAMIC_SHAPE_MARK
+
+
 class PytorchGraphNode(GraphNode):
 
 
@@ -26,31 +53,21 @@ class PytorchGraphNode(GraphNode):
         layer = args[0]
         self._name = layer.scopeName()
         self._kind = layer.kind()
-        import re
-        node_id = re.search(r"[\d]+", layer.__str__())
-        self.id = node_id.group(0)
+        self.id = _get_node_id(layer)
+        self.output_shape = _get_output_shape(layer)
 
         super(PytorchGraphNode, self).__init__(layer)
 
-        # print(self._kind)
-
+        self.value = None
         if 'Constant' in self._kind:
-            idx1 = layer.__str__().find('value')
-            idx2 = layer.__str__().find('[')
-            for i in range(idx1, len(layer.__str__())):
-                if layer.__str__()[i] in '[}]': idx2 = i; break
-            val = re.findall(r'\d+\.\d+|\d+|\-\d+\.\d+|\-\d+', layer.__str__()[idx1:idx2])
-            if 'Long' in layer.__str__():
-               for i in range(len(val)):
-                    val[i] = int(val[i])
-            else:
-                for i in range(len(val)):
-                    val[i] = float(val[i])
-            if 'LongTensor' in layer.__str__():
-                # val[0] = -1
+            # shares memory with the traced tensor
+            self.value = layer['value'].detach().cpu().numpy()
+            if self.value.dtype.kind in 'biu' or self.value.size <= 1:
+                val = self.value.reshape(-1).tolist()
                 self.attrs = {k : val for k in layer.attributeNames()}
             else:
-                self.attrs = {k : val for k in layer.attributeNames()}
+                # floating point tables are exported as packed arrays through the weights
+                self.attrs = dict()
         else:
             self.attrs = {k : layer[k] for k in layer.attributeNames()}
 
@@ -64,18 +81,14 @@ class PytorchGraphNode(GraphNode):
         self.id = args[2]
         super(PytorchGraphNode, self).__init__(layer=None)
         self.attrs = args[3] if len(args) >= 4 else {}
+        self.value = None
         self.weights_name = '.'.join(
             re.findall(r'\[([\w\d.]+)\]', self._name)
         )
 
     @property
     def name(self):
-        name = self._name + self.id
-        # Scopes created in a nested scope may have initial characters
-        # that are illegal as the initial character of an op name
-        # (viz. '-', '\', '/', and '_').
-        name = name.replace('-','n').replace('\\','n').replace('/','n').replace('_','n').replace('[','n').replace(']','n')
-        return name
+        return _make_node_name(self._name, self.id)
 
     @property
     def type(self):
@@ -96,6 +109,13 @@ class PytorchGraph(Graph):
         self.model = model
         self.state_dict = _unique_state_dict(self.model)
         self.shape_dict = dict()
+        # node name --> (output dim index --> symbol name), only for nodes seen by build_symbolic
+        self.symbolic_dims = dict()
+        # node name --> list of (position among node inputs, model input index)
+        self.input_edges = dict()
+        # (producer name, consumer name) --> output index, for edges not reading the first output.
+        # None when unknown, in traces cached before it was recorded
+        self.output_edges = dict()
 
 
     @staticmethod
@@ -122,8 +142,7 @@ class PytorchGraph(Graph):
 
     @staticmethod
     def get_node_id(node):
-        node_id = re.search(r"[\d]+", node.__str__())
-        return node_id.group(0)
+        return _get_node_id(node)
 
     @contextlib.contextmanager
     def set_training(self, model, mode):
@@ -145,18 +164,20 @@ class PytorchGraph(Graph):
                 model.train(old_mode)
 
 
-    def build(self, shape):
+    def build(self, shapes):
         """
         build graph for pytorch 0.4.0
+
+        shapes is the list of model input shapes, the model is traced with one
+        dummy tensor per shape passed positionally.
         """
 
-        import re
         # construct graph
-        dummy_input = torch.autograd.Variable(torch.randn(shape), requires_grad=False)
+        dummy_inputs = tuple(torch.autograd.Variable(torch.randn(shape), requires_grad=False) for shape in shapes)
 
 
         with self.set_training(self.model, False):
-            trace, output = torch.jit.get_trace_graph(self.model, (dummy_input, ))
+            trace, output = torch.jit.get_trace_graph(self.model, dummy_inputs)
 
         trace.set_graph(PytorchGraph._optimize_graph(trace.graph(), False))
 
@@ -165,59 +186,156 @@ class PytorchGraph(Graph):
 
 
         # input layer
-        # TODO
-
+        # graph inputs are the traced tensors followed by the parameters
+        graph_inputs = list(trace.graph().inputs())[:len(shapes)]
+        input_ids = {graph_input.unique() : idx for idx, graph_input in enumerate(graph_inputs)}
 
 
         # build each layer
         for node in nodes:
+            graph_node = PytorchGraphNode(node)
+            node_name = graph_node.name
 
-            node_id = PytorchGraph.get_node_id(node)
-            node_scope = node.scopeName()
-            node_name = node_scope + node_id
-            node_name = node_name.replace('-','n').replace('\\','n').replace('/','n').replace('_','n').replace('[','n').replace(']','n')
-            output_shape_str = re.findall(r'[^()!]+', node.__str__())[1]
-            # print(node.__str__())
-            if 'Constant' in node.__str__():
-                # print(node.__str__())
-                idx1 = node.__str__().find('value')
-                idx2 = node.__str__().find('[')
-                for i in range(idx1, len(node.__str__())):
-                    if node.__str__()[i] in '[}]': idx2 = i; break
-                val = re.findall(r'\d+\.\d+|\d+', node.__str__()[idx1:idx2])
-                for i in range(len(val)):
-                    val[i] = float(val[i])
-                output_shape = list(np.array(val).shape)
-            else:
-                output_shape = []
-                for x in output_shape_str.split(', '):
-                    x_str = x.replace('!', '')
-                    if x_str.isnumeric():
-                        output_shape.append(int(x_str))
-                    else:
-                        # RNN or other control flow related node has
-                        # Changable output shape so it is undefined
-                        output_shape = DYNAMIC_SHAPE_MARK
-                        break
-
-            self.shape_dict[node_name] = output_shape
-            self.layer_map[node_name] = PytorchGraphNode(node)
+            self.shape_dict[node_name] = graph_node.output_shape
+            self.layer_map[node_name] = graph_node
             self.layer_name_map[node_name] = node_name
 
             # input
-            for node_input in list(node.inputs()):
-
-                if PytorchGraph.get_node_id(node_input.node()) and node_input.node().scopeName():
-                    node_input_name = node_input.node().scopeName() + PytorchGraph.get_node_id(node_input.node())
-                    node_input_name = node_input_name.replace('-','n').replace('\\','n').replace('/','n').replace('_','n').replace('[','n').replace(']','n')
+            position = 0
+            for node_input in node.inputs():
+                input_node = node_input.node()
+                if input_node.scopeName():
+                    node_input_name = _make_node_name(input_node.scopeName(), _get_node_id(input_node))
                     self._make_connection(node_input_name, node_name)
-                    # print(node_input_name ,'->', node_name)
+                    output_index = [output.unique() for output in input_node.outputs()].index(node_input.unique())
+                    if output_index:
+                        self.output_edges[(node_input_name, node_name)] = output_index
+                    position += 1
+                elif node_input.unique() in input_ids:
+                    self.input_edges.setdefault(node_name, list()).append((position, input_ids[node_input.unique()]))
+                    position += 1
+
+
+        super(PytorchGraph, self).build()
+
+
+    def build_symbolic(self, shapes, symbols):
+        """Find the output dims that follow the symbolic dims of the inputs.
+
+        The model is traced again once per symbol with the input axes of that
+        symbol doubled, and every output dim that changes is recorded in
+        symbolic_dims. Reshape targets that were traced with a concrete size
+        for a symbolic dim are rewritten to infer that dim instead.
+
+        Parameters
+        ----------
+        shapes: list
+            The concrete input shapes passed to build.
+
+        symbols: OrderedDict
+            symbol name --> list of (input index, axis) taking that size.
+        """
+        reshape_targets = dict()
+        for symbol, axes in symbols.items():
+            probe_shapes = [list(shape) for shape in shapes]
+            for input_idx, axis in axes:
+                probe_shapes[input_idx][axis] *= 2
+
+            probe = PytorchGraph(self.model)
+            try:
+                probe.build([tuple(shape) for shape in probe_shapes])
+            except Exception as e:
+                print("Pytorch model cannot be traced with a different [{}], keep it static. ({})".format(symbol, e))
+                continue
+
+            for node_name, node in self.layer_map.items():
+                if not node_name in probe.layer_map:
+                    continue
+                dims = self.symbolic_dims.setdefault(node_name, dict())
+
+                base_shape = self.shape_dict[node_name]
+                probe_node_shape = probe.shape_dict[node_name]
+                if base_shape != DYNAMIC_SHAPE_MARK and probe_node_shape != DYNAMIC_SHAPE_MARK and len(base_shape) == len(probe_node_shape):
+                    for idx, (base_dim, probe_dim) in enumerate(zip(base_shape, probe_node_shape)):
+                        if base_dim != probe_dim:
+                            # a dim depending on several symbols is left unnamed
+                            dims[idx] = '' if dims.get(idx, symbol) != symbol else symbol
+
+                target = self._get_reshape_target(node)
+                if target is not None:
+                    base_target = target[1][target[2]]
+                    probe_target = self._get_reshape_target(probe.layer_map[node_name])
+                    if probe_target is not None and len(probe_target[1][probe_target[2]]) == len(base_target):
+                        varying = reshape_targets.setdefault(node_name, set())
+                        varying.update(idx for idx, (base_dim, probe_dim) in enumerate(zip(base_target, probe_target[1][probe_target[2]])) if base_dim != probe_dim)
+
+        for node_name, varying in reshape_targets.items():
+            self._generalize_reshape_target(self.layer_map[node_name], varying)
+
+
+    def _get_reshape_target(self, node):
+        # returns (holder node, attrs, key) of the target shape list of a Reshape node
+        if not node.type in ('onnx::Reshape', 'aten::reshape'):
+            return None
+        if 'shape' in node.attrs:
+            return node, node.attrs, 'shape'
+        if len(node.in_edges) > 1:
+            shape_node = self.get_node(node.in_edges[1])
+            if 'Constant' in shape_node.type and 'value' in shape_node.attrs:
+                return shape_node, shape_node.attrs, 'value'
+        return None
+
+
+    def _generalize_reshape_target(self, node, varying):
+        output_shape = self.shape_dict[node.name]
+        holder, attrs, key = self._get_reshape_target(node)
+        if len(varying) != 1 or output_shape == DYNAMIC_SHAPE_MARK or len(output_shape) != len(attrs[key]):
+            return
+
+        # infer the symbolic dim, every other dim is taken from the traced output
+        target = list(output_shape)
+        target[varying.pop()] = -1
+        attrs[key] = target
+        if holder.value is not None:
+            holder.value = np.array(target, dtype = holder.value.dtype)
+
+
+    def dump_trace(self):
+        """Return the traced graph as plain nodes, edges and shapes."""
+        nodes = list()
+        edges = list()
+        for node_name, node in self.layer_map.items():
+            nodes.append((node._name, node._kind, node.id, node.attrs, node.value, self.shape_dict[node_name]))
+            for in_node_name in node.in_edges:
+                edges.append((in_node_name, node_name))
+
+        return {'nodes' : nodes, 'edges' : edges, 'symbolic_dims' : self.symbolic_dims, 'input_edges' : self.input_edges,
+                'output_edges' : self.output_edges}
+
+
+    def build_from_trace(self, trace):
+        """Rebuild the graph from the output of dump_trace, without tracing the model."""
+        for scope_name, kind, node_id, attrs, value, output_shape in trace['nodes']:
+            graph_node = PytorchGraphNode(scope_name, kind, node_id, attrs)
+            graph_node.value = value
+            node_name = graph_node.name
+
+            self.shape_dict[node_name] = output_shape
+            self.layer_map[node_name] = graph_node
+            self.layer_name_map[node_name] = node_name
+
+        for src, dst in trace['edges']:
+            self._make_connection(src, dst)
 
+        self.symbolic_dims = trace['symbolic_dims']
+        self.input_edges = trace['input_edges']
+        self.output_edges = trace.get('output_edges')
 
         super(PytorchGraph, self).build()
 
     def remove_node(self, node):
         del self.shape_dict[node.name]
+        self.input_edges.pop(node.name, None)
         del self.layer_map[node.name]
         del self.layer_name_map[node.name]
         for in_node_name in node.in_edges:
@@ -5,13 +5,18 @@
 
 import logging
 import os
+import inspect
+import collections
+import pickle
 import numpy as np
 import ox.common.IR.graph_pb2 as graph_pb2
 from ox.common.IR.graph_pb2 import NodeDef, GraphDef, DataType
 from ox.common.utils import *
 from ox.common.DataStructure.parser import Parser
+from ox.common.cache import DiskCache
 from ox.pytorch.pytorch_graph import PytorchGraph
 from ox.pytorch.rewriter.lstm_rewriter import LstmRewriter
+from ox.rewriter.pass_manager import PassManager
 import torch
 import torchvision
 
@@ -39,7 +44,17 @@ class PytorchParser(Parser):
     'onnx::LogSoftmax': 'LogSoftmax',
     'onnx::Slice': 'Slice',
     'onnx::Squeeze': 'Squeeze',
-    'onnx::ConvTranspose': 'ConvTranspose'
+    'onnx::ConvTranspose': 'ConvTranspose',
+    'onnx::LSTM': 'LSTM'
+    }
+
+    # passes run on the traced PytorchGraph
+    passes = ['pytorch_lstm']
+
+    dtype_map = {
+        np.float16 : graph_pb2.DT_FLOAT16,
+        np.float32 : graph_pb2.DT_FLOAT32,
+        np.float64 : graph_pb2.DT_FLOAT64
     }
 
 
@@ -56,8 +71,10 @@ class PytorchParser(Parser):
     # Public Functions #
     ####################
 
-    def __init__(self, model_file_name, input_shape):
+    def __init__(self, model_file_name, input_shape, cache_dir = None, cache_size = 1024 ** 3, fused_lstm = False, passes = None,
+                 trace_memory = False):
         super(PytorchParser, self).__init__()
+        self.IR_model.framework_name = 'pytorch'
         if not os.path.exists(model_file_name):
             print("Pytorch model file [{}] is not found.".format(model_file_name))
             assert False
@@ -74,14 +91,77 @@ class PytorchParser(Parser):
         # Build network graph
         self.pytorch_graph = PytorchGraph(model)
 
-        self.input_shape = tuple([1] + input_shape)
-        self.pytorch_graph.build(self.input_shape)        
-
-        lstm_rewriter = LstmRewriter(self.pytorch_graph)
-        self.pytorch_graph = lstm_rewriter.run()
+        # input_shape is one input spec, a list of specs or a dict of specs keyed by forward argument.
+        # Spec entries are sizes or (symbol, example size) pairs. Symbolic tracing costs one more
+        # trace per symbol, it only runs when symbols are given and then the batch is one of them
+        self.input_names, input_specs = PytorchParser._split_input_specs(model, input_shape)
+        self.input_symbols = collections.OrderedDict([('batch', [(idx, 0) for idx in range(len(input_specs))])])
+        self.input_shapes = list()
+        for input_idx, input_spec in enumerate(input_specs):
+            input_sizes = [1]
+            for axis, dim in enumerate(input_spec, 1):
+                if isinstance(dim, (tuple, list)):
+                    self.input_symbols.setdefault(dim[0], list()).append((input_idx, axis))
+                    dim = dim[1]
+                input_sizes.append(dim)
+            self.input_shapes.append(tuple(input_sizes))
+        if len(self.input_symbols) == 1:
+            self.input_symbols.clear()
+
+        # the optimized trace only depends on the model file, the input shape and the torch version
+        trace = None
+        if cache_dir:
+            cache = DiskCache(cache_dir, cache_size)
+            cache_key = DiskCache.make_key(DiskCache.hash_file(model_file_name), self.input_shapes,
+                                           list(self.input_symbols.items()), torch.__version__)
+            trace = cache.get(cache_key)
+
+        if trace is None:
+            self.pytorch_graph.build(self.input_shapes)
+            if self.input_symbols:
+                self.pytorch_graph.build_symbolic(self.input_shapes, self.input_symbols)
+            if cache_dir:
+                cache.put(cache_key, pickle.dumps(self.pytorch_graph.dump_trace(), pickle.HIGHEST_PROTOCOL))
+        else:
+            print("Pytorch trace [{}] loaded from cache.".format(cache_key))
+            self.pytorch_graph.build_from_trace(pickle.loads(trace))
 
         self.state_dict = self.pytorch_graph.state_dict
+
+        self.pass_manager = PassManager(self.passes if passes is None else passes, {'pytorch_lstm' : {'fused' : fused_lstm}},
+                                        trace_memory = trace_memory)
+        self.pass_manager.run(self.pytorch_graph, self.state_dict)
+        self.pass_manager.report()
+
         self.shape_dict = self.pytorch_graph.shape_dict
+        self.symbolic_dims = self.pytorch_graph.symbolic_dims
+
+
+    @staticmethod
+    def _is_input_spec(spec):
+        return all(isinstance(dim, int) or
+                   (isinstance(dim, (tuple, list)) and len(dim) == 2 and isinstance(dim[0], str))
+                   for dim in spec)
+
+
+    @staticmethod
+    def _split_input_specs(model, input_shape):
+        """Return the DataInput names and the input specs in forward argument order."""
+        if isinstance(input_shape, dict):
+            arg_names = list(inspect.signature(model.forward).parameters)[:len(input_shape)]
+            assert set(arg_names) == set(input_shape), \
+                "Pytorch input names {} are not the leading forward arguments {}.".format(list(input_shape), arg_names)
+            return arg_names, [input_shape[name] for name in arg_names]
+
+        if PytorchParser._is_input_spec(input_shape):
+            return ['input'], [input_shape]
+
+        return ['input_{}'.format(idx) for idx in range(len(input_shape))], list(input_shape)
+
+
+    def _get_weight(self, name):
+        # shares memory with the CPU tensor, save_weights streams it to disk without a copy
+        return self.state_dict[name].detach().cpu().numpy()
 
 
     def gen_IR(self):
@@ -113,42 +193,46 @@ class PytorchParser(Parser):
 
 
     def _set_output_shape(self, source_node, IR_node):
+        shape_pytorch = self.shape_dict[source_node.name]
+        shape = PytorchParser._make_shape(shape_pytorch, self.symbolic_dims.get(source_node.name))
+        IR_node.attr["_output_shapes"].list.shape.extend([shape])
 
-        shape = graph_pb2.TensorShape()
-
-
-        layer_name = source_node.name
 
-        shape_pytorch = self.shape_dict[layer_name]
+    @staticmethod
+    def _make_dim(shape, shape_pytorch, index, symbols):
+        new_dim = shape.dim.add()
+        dim = shape_pytorch[index]
+        if symbols is None:
+            # not traced symbolically, take a leading 1 as the batch
+            if index == 0 and dim == 1:
+                new_dim.size = -1
+            else:
+                new_dim.size = dim if dim else -1
+        elif index in symbols:
+            new_dim.size = -1
+            new_dim.name = symbols[index]
+        else:
+            new_dim.size = dim if dim else -1
 
 
-        new_dim = shape.dim.add()
+    @staticmethod
+    def _make_shape(shape_pytorch, symbols):
+        shape = graph_pb2.TensorShape()
 
         # (batch, C, H, W)  & NHWC
         if len(shape_pytorch) == 4:
-
-            if shape_pytorch[0] == 1:
-                new_dim.size = -1
-            else:
-                new_dim.size = shape_pytorch[0]
-            for index in [2, 3, 1]:
-                new_dim = shape.dim.add()
-                dim = shape_pytorch[index]
-                new_dim.size = dim if dim else -1
+            for index in [0, 2, 3, 1]:
+                PytorchParser._make_dim(shape, shape_pytorch, index, symbols)
         elif len(shape_pytorch) == 2:
-            if shape_pytorch[0] == 1:
-                new_dim.size = -1
-            else:
-                new_dim.size = shape_pytorch[0]
+            PytorchParser._make_dim(shape, shape_pytorch, 0, symbols)
             for _ in range(2):
                 new_dim = shape.dim.add()
                 new_dim.size = 1
-            new_dim = shape.dim.add()
-            dim = shape_pytorch[1]
-            new_dim.size = dim if dim else -1
+            PytorchParser._make_dim(shape, shape_pytorch, 1, symbols)
+        else:
+            shape.dim.add()
 
-
-        IR_node.attr["_output_shapes"].list.shape.extend([shape])
+        return shape
 
     ##########
     # Layers #
@@ -161,59 +245,33 @@ class PytorchParser(Parser):
               % (source_node.type, source_node.name))
 
     def gen_Input(self):
-        IR_node = self.IR_graph.node.add()
-        IR_node.name = 'input'
-        IR_node.op = "DataInput"
-
+        # keep the position of the model input among the node inputs
         for node in self.IR_graph.node:
-            if node.name in self.src_graph.input_layers:
-                if not 'onstant' in self.pytorch_graph.layer_map[node.name]._kind:
-                    node.input.append('input')
-
-        assert len(self.input_shape) == 4
-        new_dim = IR_node.attr["shape"].shape.dim.add()
-        if self.input_shape[0] == 1:
-            new_dim.size = -1
-        else:
-            new_dim.size = self.input_shape[0]
-        for index in [2, 3, 1]:
-            new_dim = IR_node.attr["shape"].shape.dim.add()
-            new_dim.size = self.input_shape[index]
-
-        shape = graph_pb2.TensorShape()
-        new_dim = shape.dim.add()
-        shape_pytorch = self.input_shape
+            for position, input_idx in self.pytorch_graph.input_edges.get(node.name, []):
+                node.input.insert(position, self.input_names[input_idx])
 
-        if len(shape_pytorch) == 4:
-
-            if shape_pytorch[0] == 1:
-                new_dim.size = -1
-            else:
-                new_dim.size = shape_pytorch[0]
-            for index in [2, 3, 1]:
-                new_dim = shape.dim.add()
-                dim = shape_pytorch[index]
-                new_dim.size = dim if dim else -1
-        elif len(shape_pytorch) == 2:
-            if shape_pytorch[0] == 1:
-                new_dim.size = -1
-            else:
-                new_dim.size = shape_pytorch[0]
-            for _ in range(2):
-                new_dim = shape.dim.add()
-                new_dim.size = 1
-            new_dim = shape.dim.add()
-            dim = shape_pytorch[1]
-            new_dim.size = dim if dim else -1
+        input_dims = [dict() for _ in self.input_shapes]
+        for symbol, axes in self.input_symbols.items():
+            for input_idx, axis in axes:
+                input_dims[input_idx][axis] = symbol
 
+        for input_name, input_shape, dims in zip(self.input_names, self.input_shapes, input_dims):
+            IR_node = self.IR_graph.node.add()
+            IR_node.name = input_name
+            IR_node.op = "DataInput"
 
-        IR_node.attr["_output_shapes"].list.shape.extend([shape])
+            shape = PytorchParser._make_shape(input_shape, dims or None)
+            IR_node.attr["shape"].shape.CopyFrom(shape)
+            IR_node.attr["_output_shapes"].list.shape.extend([shape])
 
     def rename_Constant(self, source_node):
         IR_node = self.IR_graph.node.add()
         IR_node.name = source_node.name
         IR_node.op = "Constant"
         assign_IRnode_values(IR_node, source_node.attrs)
+        if source_node.value is not None and not 'value' in source_node.attrs:
+            IR_node.attr['dtype'].type = PytorchParser.dtype_map[source_node.value.dtype.type]
+            self.set_weight(source_node.name, 'value', source_node.value)
         self._set_output_shape(source_node, IR_node)
 
     def rename_Conv(self, source_node):
@@ -242,7 +300,7 @@ class PytorchParser(Parser):
         bias_name = '{0}.bias'.format(source_node.weights_name)
         weights_name = '{0}.weight'.format(source_node.weights_name)
 
-        weight = self.state_dict[weights_name].numpy()
+        weight = self._get_weight(weights_name)
 
         dim = weight.ndim - 2
 
@@ -257,7 +315,7 @@ class PytorchParser(Parser):
 
         # handle bias
         if bias_name in self.state_dict:
-            bias = self.state_dict[bias_name].numpy()
+            bias = self._get_weight(bias_name)
             self.set_weight(source_node.name, 'bias', bias)
             kwargs['use_bias'] = True
         else:
@@ -299,7 +357,7 @@ class PytorchParser(Parser):
         bias_name = '{0}.bias'.format(source_node.weights_name)
         weights_name = '{0}.weight'.format(source_node.weights_name)
 
-        weight = self.state_dict[weights_name].numpy()
+        weight = self._get_weight(weights_name)
 
         dim = weight.ndim - 2
 
@@ -314,7 +372,7 @@ class PytorchParser(Parser):
 
         # handle bias
         if bias_name in self.state_dict:
-            bias = self.state_dict[bias_name].numpy()
+            bias = self._get_weight(bias_name)
             self.set_weight(source_node.name, 'bias', bias)
             kwargs['use_bias'] = True
         else:
@@ -344,19 +402,19 @@ class PytorchParser(Parser):
 
 
         if bias_name in self.state_dict:
-            beta = self.state_dict[bias_name].numpy()
+            beta = self._get_weight(bias_name)
             IR_node.attr['bias'].b = True
         else:
             IR_node.attr['bias'].b = False
 
         if weights_name in self.state_dict:
-            gamma = self.state_dict[weights_name].numpy()
+            gamma = self._get_weight(weights_name)
             IR_node.attr['scale'].b = True
         else:
             IR_node.attr['scale'].b = False
 
-        mean = self.state_dict[mean_name].numpy()
-        variance = self.state_dict[var_name].numpy()
+        mean = self._get_weight(mean_name)
+        variance = self._get_weight(var_name)
 
         if IR_node.attr['scale'].b:
             self.set_weight(source_node.name, "scale", gamma)
@@ -370,6 +428,34 @@ class PytorchParser(Parser):
         # var
         self.set_weight(source_node.name, "var", variance)
 
+    def rename_LSTM(self, source_node):
+        IR_node = self._convert_identity_operation(source_node, new_op="LSTM")
+        attr = source_node.attrs
+
+        # gates stay packed in PyTorch order (i, f, g, o)
+        weights_ih = self._get_weight('{0}.weight_ih_l{1}'.format(source_node.weights_name, attr['layer_id']))
+        weights_hh = self._get_weight('{0}.weight_hh_l{1}'.format(source_node.weights_name, attr['layer_id']))
+        self.set_weight(source_node.name, 'weights_ih', weights_ih)
+        self.set_weight(source_node.name, 'weights_hh', weights_hh)
+
+        bias_ih_name = '{0}.bias_ih_l{1}'.format(source_node.weights_name, attr['layer_id'])
+        bias_hh_name = '{0}.bias_hh_l{1}'.format(source_node.weights_name, attr['layer_id'])
+        if bias_ih_name in self.state_dict:
+            self.set_weight(source_node.name, 'bias_ih', self._get_weight(bias_ih_name))
+            self.set_weight(source_node.name, 'bias_hh', self._get_weight(bias_hh_name))
+            IR_node.attr['use_bias'].b = True
+        else:
+            IR_node.attr['use_bias'].b = False
+
+        IR_node.attr['hidden_size'].i = attr['hidden_size']
+        IR_node.attr['input_size'].i = weights_ih.shape[1]
+
+        # (seq_len, batch, hidden_size)
+        shape_pytorch = self.shape_dict[source_node.name]
+        if len(shape_pytorch) == 3:
+            IR_node.attr["_output_shapes"].list.shape.pop()
+            IR_node.attr["_output_shapes"].list.shape.extend([list_to_shape([shape_pytorch[0], -1, shape_pytorch[2]])])
+
     def rename_Reshape(self, source_node):
         # print('Reshape:', source_node.attrs, source_node.type)
         IR_node = self._convert_identity_operation(source_node, new_op="Reshape")
@@ -403,6 +489,7 @@ class PytorchParser(Parser):
         IR_node = self._convert_identity_operation(source_node, new_op="Slice")
         kwargs = dict()
         kwargs['shrink_axis_mask'] = source_node.attrs['axes'][0]
+        kwargs['axes'] = list(source_node.attrs['axes'])
         kwargs['starts'] = source_node.attrs['starts']
         kwargs['ends'] = source_node.attrs['ends']
         if 'input_from_param' in source_node.attrs:
@@ -413,7 +500,7 @@ class PytorchParser(Parser):
                 for param_name in input_from_param:
                     assert isinstance(param_name, str), "set 'input_from_param' as illegal type."
                     concat_name += ("_" + param_name)
-                    param_numpy = self.state_dict[param_name].numpy()
+                    param_numpy = self._get_weight(param_name)
                     concat_numpy = np.concatenate((concat_numpy, param_numpy)).astype(param_numpy.dtype)
                 kwargs['input_from_param'] = concat_name
                 self.set_weight(source_node.name, concat_name, concat_numpy)
@@ -421,7 +508,7 @@ class PytorchParser(Parser):
                 param_name = input_from_param
                 assert isinstance(input_from_param, str), "set 'input_from_param' as illegal type."
                 kwargs['input_from_param'] = param_name
-                param_numpy = self.state_dict[param_name].numpy()
+                param_numpy = self._get_weight(param_name)
                 self.set_weight(source_node.name, param_name, param_numpy)
         assign_IRnode_values(IR_node, kwargs)        
 
@@ -483,7 +570,7 @@ class PytorchParser(Parser):
         weights_name = '{0}.weight'.format(source_node.weights_name)
 
 
-        W = self.state_dict[weights_name].numpy().transpose()
+        W = self._get_weight(weights_name).transpose()
         input_channels, output_channels = W.shape
 
         # Kit weight tranpose
@@ -508,7 +595,7 @@ class PytorchParser(Parser):
         # use_bias
         if bias_name in self.state_dict:
             IR_node.attr['use_bias'].b = True
-            bias = self.state_dict[bias_name].numpy()
+            bias = self._get_weight(bias_name)
             self.set_weight(source_node.name, 'bias', bias )
         else:
             IR_node.attr['use_bias'].b = False
@@ -2,6 +2,7 @@ import numpy as np
 import re
 from ox.pytorch.pytorch_graph import DYNAMIC_SHAPE_MARK
 from ox.pytorch.pytorch_graph import PytorchGraphNode
+from ox.rewriter.pass_manager import Pass, register_pass
 
 
 class LstmRewriter(object):
@@ -14,10 +15,18 @@ class LstmRewriter(object):
 
     Note: we only handle singe-directional lstm here and use defualt peephole
     weight (0). The support for those will be TODO.
+
+    With fused=True the onnx::lstm op is kept as a single node whose gate
+    weights are read from the state dict, so the graph size does not depend
+    on the sequence length. Ops with non-zero initial states are still
+    expanded.
     """
-    def __init__(self, pytorch_graph):
+    def __init__(self, pytorch_graph, fused=False):
         self.pytorch_graph = pytorch_graph
         self.unique_id = 0
+        self.fused = fused
+        # weights name --> number of fused layers seen, nn.LSTM layers appear in order
+        self.layer_ids = {}
 
     def get_next_unique_id(self):
         self.unique_id += 1
@@ -36,6 +45,11 @@ class LstmRewriter(object):
                 replace_nodes.append(current_node)
 
         for lstm_id, lstm_node in enumerate(replace_nodes):
+            if self.fused and self.has_zero_initial_state(lstm_node):
+                if not self.has_state_outputs_used(lstm_node):
+                    self.process_fused_lstm(lstm_node)
+                    continue
+                print("LSTM [{}] final states are used, it is expanded instead of fused.".format(lstm_node.name))
             self.process_lstm(lstm_node, lstm_id)
             self.pytorch_graph.remove_node(lstm_node)
 
@@ -51,6 +65,71 @@ class LstmRewriter(object):
         for node in remove_node:
             self.pytorch_graph.remove_node(node)
 
+    def has_zero_initial_state(self, lstm_node):
+        for state_name in lstm_node.in_edges[5:7]:
+            state_node = self.pytorch_graph.get_node(state_name)
+            if state_node.type != "onnx::Constant":
+                return False
+            if state_node.value is not None:
+                if np.any(state_node.value):
+                    return False
+            elif any(state_node.attrs.get("value", [1])):
+                return False
+        return True
+
+    def has_state_outputs_used(self, lstm_node):
+        """
+        Whether Y_h or Y_c, which the fused op does not produce, are read. Also
+        true when the output indices of the edges are not known.
+        """
+        output_edges = self.pytorch_graph.output_edges
+        if output_edges is None:
+            return True
+        return any(output_edges.get((lstm_node.name, name), 0) for name in lstm_node.out_edges)
+
+    def process_fused_lstm(self, lstm_node):
+        """
+        Keeps lstm node as a single op reading x only. Gate weights are taken
+        from the state dict by the parser, so the nodes producing them and the
+        initial states are dropped.
+        """
+        lstm_inputs = lstm_node.in_edges
+        x_shape = self.pytorch_graph.shape_dict[lstm_inputs[0]]
+        hidden_size = lstm_node.attrs["hidden_size"]
+
+        unused_nodes = []
+        for in_node_name in lstm_inputs[1:]:
+            in_node = self.pytorch_graph.get_node(in_node_name)
+            in_node.out_edges.remove(lstm_node.name)
+            unused_nodes.append(in_node)
+        lstm_node.in_edges = lstm_inputs[:1]
+        layer_id = self.layer_ids.get(lstm_node.weights_name, 0)
+        self.layer_ids[lstm_node.weights_name] = layer_id + 1
+        lstm_node.attrs["layer_id"] = layer_id
+
+        # y is [seq_len, num_directions, batch_size, hidden_size], the fused op
+        # squeezes num_directions like nn.LSTM does
+        for out_node_name in list(lstm_node.out_edges):
+            out_node = self.pytorch_graph.get_node(out_node_name)
+            if out_node.type == "onnx::Squeeze" and out_node.attrs.get("axes") == [1]:
+                for next_node_name in out_node.out_edges:
+                    next_node = self.pytorch_graph.get_node(next_node_name)
+                    next_node.in_edges[next_node.in_edges.index(out_node.name)] = lstm_node.name
+                    lstm_node.out_edges.append(next_node_name)
+                out_node.out_edges = []
+                unused_nodes.append(out_node)
+
+        if x_shape != DYNAMIC_SHAPE_MARK:
+            self.pytorch_graph.shape_dict[lstm_node.name] = [x_shape[0], x_shape[1], hidden_size]
+
+        while unused_nodes:
+            node = unused_nodes.pop()
+            if node is lstm_node or node.out_edges or not node.name in self.pytorch_graph.layer_map:
+                continue
+            in_nodes = [self.pytorch_graph.get_node(name) for name in node.in_edges]
+            self.pytorch_graph.remove_node(node)
+            unused_nodes.extend(in_nodes)
+
     def process_lstm(self, lstm_node, lstm_id):
         """
         Inserts detail nodes that are equivalent to lstm node.
@@ -343,3 +422,11 @@ class LstmRewriter(object):
         self.pytorch_graph.layer_name_map[node.name] = node.name
 
         return node
+
+
+@register_pass('pytorch_lstm')
+class LstmRewritePass(Pass):
+    """Rewrites the onnx::LSTM ops of a PytorchGraph, options are the LstmRewriter arguments."""
+
+    def run(self, graph, weights_dict):
+        LstmRewriter(graph, **self.options).run()
@@ -0,0 +1,73 @@
+import numpy as np
+from ox.rewriter.pass_manager import Pass, register_pass
+
+
+@register_pass('fuse_activations')
+class ActivationFusionPass(Pass):
+    """Fuses elementwise activations into the Conv, DepthwiseConv or FullyConnected producing them.
+
+    The activation type is stored in the producer's 'fused_activation' attr
+    and the activation node is removed. An Add of a Constant per-channel bias
+    between the producer and the activation is first folded into the
+    producer's bias. Producers with other consumers are left alone.
+    """
+
+    producer_types = ('Conv', 'DepthwiseConv', 'FullyConnected')
+
+    activation_types = ('Relu', 'Relu6', 'Sigmoid', 'Tanh', 'Elu')
+
+    def run(self, graph, weights_dict):
+        fused = 0
+        for producer in graph.get_nodes_by_type(self.producer_types):
+            if not producer.name in graph.layer_map or producer.get_attr('fused_activation'):
+                continue
+
+            consumer = self._get_consumer(graph, weights_dict, producer)
+            if consumer is not None and consumer.type == 'Add' and self._fold_bias_add(graph, weights_dict, producer, consumer):
+                consumer = self._get_consumer(graph, weights_dict, producer)
+
+            if consumer is not None and consumer.type in self.activation_types:
+                producer.layer.attr['fused_activation'].s = consumer.type.encode()
+                graph.bypass_node(consumer)
+                fused += 1
+
+        if fused:
+            graph.rebuild()
+        print("Fused [{}] activations.".format(fused))
+
+
+    def _get_consumer(self, graph, weights_dict, producer):
+        if len(producer.out_edges) != 1:
+            return None
+        consumer = graph.get_node(producer.out_edges[0])
+        if consumer.name in weights_dict or consumer.get_attr('scope') != producer.get_attr('scope'):
+            return None
+        if any(':' in edge for edge in consumer.in_edges):
+            return None
+        return consumer
+
+
+    def _fold_bias_add(self, graph, weights_dict, producer, add_node):
+        if len(add_node.in_edges) != 2 or not producer.name in weights_dict:
+            return False
+        bias_node = graph.get_node(add_node.in_edges[1] if add_node.in_edges[0] == producer.name else add_node.in_edges[0])
+        if bias_node.type != 'Constant' or bias_node.out_edges != [add_node.name]:
+            return False
+
+        if bias_node.name in weights_dict and 'value' in weights_dict[bias_node.name]:
+            value = np.asarray(weights_dict[bias_node.name]['value'])
+        else:
+            value = np.asarray(bias_node.get_attr('value'))
+        kernel = weights_dict[producer.name]['weights']
+        channels = kernel.shape[-1] if producer.type != 'DepthwiseConv' else kernel.shape[-2] * kernel.shape[-1]
+        if value.size != channels or any(dim != 1 for dim in value.shape[:-1]):
+            return False
+
+        bias = weights_dict[producer.name].get('bias', np.zeros(channels, dtype = kernel.dtype))
+        weights_dict[producer.name]['bias'] = (bias + value.reshape(-1)).astype(kernel.dtype)
+        producer.layer.attr['use_bias'].b = True
+
+        graph.bypass_node(add_node, add_node.in_edges.index(producer.name))
+        graph.delete_node(bias_node)
+        weights_dict.pop(bias_node.name, None)
+        return True
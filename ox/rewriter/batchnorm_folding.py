@@ -0,0 +1,115 @@
+import numpy as np
+from ox.rewriter.pass_manager import Pass, register_pass
+
+
+def _apply(node_type, kernel, bias, inputs):
+    # output channels of the producer for a batch of flattened receptive fields
+    if node_type == 'DepthwiseConv':
+        in_channels, multiplier = kernel.shape[-2:]
+        out = np.einsum('nsc,scm->ncm', inputs, kernel.reshape(-1, in_channels, multiplier))
+        return out.reshape(inputs.shape[0], -1) + bias
+    return inputs.dot(kernel.reshape(-1, kernel.shape[-1])) + bias
+
+
+def _reference(node_type, kernel, bias, patches):
+    # the same outputs from unflattened receptive fields, for the parity check
+    if node_type == 'DepthwiseConv':
+        out = (patches[..., np.newaxis] * kernel).sum(axis = tuple(range(1, kernel.ndim - 1)))
+        return out.reshape(patches.shape[0], -1) + bias
+    return np.tensordot(patches, kernel, axes = kernel.ndim - 1) + bias
+
+
+@register_pass('fold_batchnorm')
+class BatchNormFoldingPass(Pass):
+    """Folds inference BatchNorm into the preceding Conv, DepthwiseConv or FullyConnected.
+
+    With a = scale / sqrt(var + epsilon), the producer kernel is scaled by a
+    along its output channels and its bias becomes (bias - mean) * a + offset.
+    The BatchNorm node and its weights are removed. Every fold is checked on
+    random inputs against the unfolded producer followed by the BatchNorm, both
+    computed from the original weights, and skipped if it differs.
+
+    Not in the default passes of the emitters, which add it before
+    fuse_activations when given fold_batchnorm = True.
+
+    Options
+    -------
+    check: bool, default True
+        Run the parity check.
+
+    rtol: float, default 1e-4
+        Relative tolerance of the parity check.
+    """
+
+    producer_types = ('Conv', 'DepthwiseConv', 'FullyConnected')
+
+    def run(self, graph, weights_dict):
+        folded = 0
+        for bn_node in graph.get_nodes_by_type('BatchNorm'):
+            producer = self._get_producer(graph, weights_dict, bn_node)
+            if producer is None:
+                continue
+
+            if self._fold(producer, bn_node, weights_dict):
+                graph.bypass_node(bn_node)
+                del weights_dict[bn_node.name]
+                folded += 1
+
+        if folded:
+            graph.rebuild()
+        print("Folded [{}] BatchNorm nodes.".format(folded))
+
+
+    def _get_producer(self, graph, weights_dict, bn_node):
+        if len(bn_node.in_edges) != 1 or ':' in bn_node.in_edges[0]:
+            return None
+        if bn_node.get_attr('data_format', 'NHWC') == 'NCHW':
+            return None
+        if not bn_node.name in weights_dict or not 'mean' in weights_dict[bn_node.name]:
+            return None
+
+        producer = graph.get_node(bn_node.in_edges[0])
+        if not producer.type in self.producer_types or producer.out_edges != [bn_node.name]:
+            return None
+        if not producer.name in weights_dict or not 'weights' in weights_dict[producer.name]:
+            return None
+        return producer
+
+
+    def _fold(self, producer, bn_node, weights_dict):
+        producer_weights = weights_dict[producer.name]
+        bn_weights = weights_dict[bn_node.name]
+
+        kernel = producer_weights['weights']
+        channels = kernel.shape[-1] if producer.type != 'DepthwiseConv' else kernel.shape[-2] * kernel.shape[-1]
+        bias = producer_weights.get('bias', np.zeros(channels, dtype = kernel.dtype))
+
+        mean = bn_weights['mean']
+        var = bn_weights['var']
+        scale = bn_weights.get('scale', np.ones(channels, dtype = kernel.dtype))
+        offset = bn_weights.get('bias', np.zeros(channels, dtype = kernel.dtype))
+        epsilon = bn_node.get_attr('epsilon', 0.0)
+
+        multiplier = scale.astype(np.float64) / np.sqrt(var.astype(np.float64) + epsilon)
+        new_kernel = (kernel.astype(np.float64) * multiplier.reshape(kernel.shape[-2:] if producer.type == 'DepthwiseConv' else -1)).astype(kernel.dtype)
+        new_bias = ((bias.astype(np.float64) - mean) * multiplier + offset).astype(kernel.dtype)
+
+        if self.options.get('check', True):
+            rng = np.random.RandomState(0)
+            patches = rng.standard_normal((4,) + kernel.shape[:-1])
+            produced = _reference(producer.type, kernel.astype(np.float64), bias.astype(np.float64), patches)
+            expected = (produced - mean) / np.sqrt(var.astype(np.float64) + epsilon) * scale + offset
+            if producer.type == 'DepthwiseConv':
+                inputs = patches.reshape(4, -1, kernel.shape[-2])
+            else:
+                inputs = patches.reshape(4, -1)
+            actual = _apply(producer.type, new_kernel.astype(np.float64), new_bias, inputs)
+            atol = self.options.get('rtol', 1e-4) * max(1.0, np.abs(expected).max())
+            if not np.allclose(actual, expected, rtol = self.options.get('rtol', 1e-4), atol = atol):
+                print("Warning: BatchNorm [{}] is not folded into [{}], parity check failed.".format(bn_node.name, producer.name))
+                return False
+
+        producer_weights['weights'] = new_kernel
+        producer_weights['bias'] = new_bias
+        producer.layer.attr['use_bias'].b = True
+        return True
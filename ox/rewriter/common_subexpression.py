@@ -0,0 +1,69 @@
+import numpy as np
+from ox.rewriter.pass_manager import Pass, register_pass
+
+
+def _same_weights(weights_dict, name, other_name):
+    weights = weights_dict.get(name, dict())
+    other_weights = weights_dict.get(other_name, dict())
+    if set(weights) != set(other_weights):
+        return False
+    for key, value in weights.items():
+        other_value = other_weights[key]
+        if isinstance(value, np.ndarray) or isinstance(other_value, np.ndarray):
+            value, other_value = np.asarray(value), np.asarray(other_value)
+            if value.dtype != other_value.dtype or not np.array_equal(value, other_value):
+                return False
+        elif value != other_value:
+            return False
+    return True
+
+
+@register_pass('eliminate_common_subexpressions')
+class CommonSubexpressionPass(Pass):
+    """Merges nodes computing the same value from the same inputs.
+
+    Nodes are visited in topological order and keyed on their op, their attrs
+    (but the output shapes) and their inputs, where the inputs of a merged
+    node already point to the node it was merged into. Nodes with the same
+    key are merged when their weights are equal too. Graph inputs, graph
+    outputs and random ops are never merged.
+    """
+
+    excluded_types = ('DataInput', 'RandomUniform', 'RandomNormal', 'RandomStandardNormal',
+                      'TruncatedNormal', 'Multinomial', 'RandomShuffle', 'Dropout')
+
+    commutative_types = ('Add', 'Mul', 'Maximum', 'Minimum')
+
+    def run(self, graph, weights_dict):
+        table = dict()
+        merged = 0
+        for name in list(graph.topological_sort):
+            node = graph.layer_map.get(name)
+            if node is None or not node.out_edges or node.type in self.excluded_types:
+                continue
+
+            candidates = table.setdefault(self._get_key(node), list())
+            for other in candidates:
+                if _same_weights(weights_dict, node.name, other.name):
+                    self._merge(graph, weights_dict, node, other)
+                    merged += 1
+                    break
+            else:
+                candidates.append(node)
+
+        if merged:
+            graph.rebuild()
+        print("Merged [{}] common subexpressions.".format(merged))
+
+
+    def _get_key(self, node):
+        attrs = tuple(sorted((key, value.SerializeToString()) for key, value in node.layer.attr.items() if key != '_output_shapes'))
+        inputs = tuple(sorted(node.in_edges) if node.type in self.commutative_types else node.in_edges)
+        return (node.type, attrs, inputs)
+
+
+    def _merge(self, graph, weights_dict, node, other):
+        for out_node_name in list(node.out_edges):
+            graph.replace_input(graph.get_node(out_node_name), node.name, other.name)
+        graph.delete_node(node)
+        weights_dict.pop(node.name, None)
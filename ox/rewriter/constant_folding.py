@@ -0,0 +1,295 @@
+import numpy as np
+import ox.common.IR.graph_pb2 as graph_pb2
+from ox.common.utils import shape_to_list, list_to_shape
+from ox.rewriter.pass_manager import Pass, register_pass
+
+
+# dtypes of folded constants, limited to what the emitters can declare
+_dtype_map = {
+    np.dtype(np.float16) : graph_pb2.DT_FLOAT16,
+    np.dtype(np.float32) : graph_pb2.DT_FLOAT32,
+    np.dtype(np.float64) : graph_pb2.DT_FLOAT64,
+    np.dtype(np.int16)   : graph_pb2.DT_INT16,
+    np.dtype(np.int32)   : graph_pb2.DT_INT32,
+    np.dtype(np.int64)   : graph_pb2.DT_INT64,
+    np.dtype(np.uint8)   : graph_pb2.DT_UINT8,
+    np.dtype(np.uint16)  : graph_pb2.DT_UINT16,
+}
+
+_numpy_dtype_map = dict((v, k) for k, v in _dtype_map.items())
+
+
+def _static_shape(node):
+    shapes = node.get_attr('_output_shapes')
+    if not shapes or shapes[0].unknown_rank:
+        return None
+    shape = shape_to_list(shapes[0])
+    if any(dim < 0 for dim in shape):
+        return None
+    return shape
+
+
+def _constant_value(node, weights_dict):
+    if node.name in weights_dict and 'value' in weights_dict[node.name]:
+        value = weights_dict[node.name]['value']
+    elif 'value' in node.layer.attr:
+        value = node.get_attr('value')
+        if isinstance(value, str):
+            return None
+        if node.get_attr('full_shape') is not None:
+            value = np.full(node.get_attr('full_shape'), value)
+    else:
+        return None
+
+    dtype = _numpy_dtype_map.get(node.get_attr('dtype'))
+    value = np.asarray(value, dtype = dtype)
+    if dtype is None and value.dtype == np.float64:
+        value = value.astype(np.float32)
+    elif dtype is None and value.dtype == np.int64:
+        value = value.astype(np.int32)
+    return value
+
+
+def _binary(func):
+    def _eval(node, values):
+        ret = values[0]
+        for value in values[1:]:
+            ret = func(ret, value)
+        return ret
+    return _eval
+
+
+def _unary(func):
+    return lambda node, values: func(values[0]).astype(values[0].dtype)
+
+
+def _div(a, b):
+    if np.issubdtype(a.dtype, np.integer) and np.issubdtype(b.dtype, np.integer):
+        return np.floor_divide(a, b)
+    return np.true_divide(a, b).astype(np.result_type(a, b))
+
+
+def _attr_or_input(node, values, attr, idx):
+    if attr in node.layer.attr:
+        return node.get_attr(attr)
+    if len(values) > idx:
+        return values[idx].tolist()
+    return None
+
+
+def _eval_Reshape(node, values):
+    shape = _attr_or_input(node, values, 'shape', 1)
+    return values[0].reshape(shape)
+
+
+def _eval_Transpose(node, values):
+    perm = _attr_or_input(node, values, 'perm', 1)
+    if perm is None and node.get_attr('perm_list'):
+        # pytorch transpose(dim0, dim1)
+        dims = node.get_attr('perm_list')
+        perm = list(range(values[0].ndim))
+        perm[dims[0]], perm[dims[1]] = perm[dims[1]], perm[dims[0]]
+    if perm is None:
+        return None
+    return np.transpose(values[0], perm)
+
+
+def _eval_Concat(node, values):
+    return np.concatenate(values, axis = node.get_attr('axis', 0))
+
+
+def _eval_Pack(node, values):
+    if node.get_attr('N') is not None and node.get_attr('N') != len(values):
+        return None
+    return np.stack(values, axis = node.get_attr('axis', 0))
+
+
+def _eval_Squeeze(node, values):
+    axes = node.get_attr('axes')
+    return np.squeeze(values[0], axis = tuple(axes) if axes else None)
+
+
+def _eval_Unsqueeze(node, values):
+    ret = values[0]
+    for axis in node.get_attr('axes'):
+        ret = np.expand_dims(ret, axis)
+    return ret
+
+
+def _eval_Slice(node, values):
+    starts = _attr_or_input(node, values, 'starts', 1)
+    ends = _attr_or_input(node, values, 'ends', 2)
+    strides = _attr_or_input(node, values, 'strides', 3)
+    if starts is None or ends is None:
+        return None
+
+    if node.type == 'Slice' and ('axes' in node.layer.attr or 'shrink_axis_mask' in node.layer.attr):
+        # pytorch, onnx Slice with end indices along axes, older IR only keeps the first axis
+        index = [slice(None)] * values[0].ndim
+        for axis, start, end in zip(node.get_attr('axes') or [node.get_attr('shrink_axis_mask', 0)], starts, ends):
+            index[axis] = slice(start, end)
+        return values[0][tuple(index)]
+
+    if node.type == 'Slice' and not 'begin_mask' in node.layer.attr:
+        # tf.slice, ends holds the sizes
+        index = [slice(start, None if size == -1 else start + size) for start, size in zip(starts, ends)]
+        return values[0][tuple(index)]
+
+    strides = strides or [1] * len(starts)
+    begin_mask = node.get_attr('begin_mask', 0)
+    end_mask = node.get_attr('end_mask', 0)
+    shrink_axis_mask = node.get_attr('shrink_axis_mask', 0)
+    new_axis_mask = node.get_attr('new_axis_mask', 0)
+    if node.get_attr('ellipsis_mask', 0):
+        return None
+
+    index = list()
+    for i, (start, end, stride) in enumerate(zip(starts, ends, strides)):
+        if new_axis_mask & (1 << i):
+            index.append(np.newaxis)
+        elif shrink_axis_mask & (1 << i):
+            index.append(start)
+        else:
+            index.append(slice(None if begin_mask & (1 << i) else start,
+                               None if end_mask & (1 << i) else end,
+                               stride))
+    return np.asarray(values[0][tuple(index)])
+
+
+def _eval_Cast(node, values):
+    dst = node.get_attr('dstType')
+    if dst == 'float':
+        return values[0].astype(np.float32)
+    elif dst == 'int':
+        return values[0].astype(np.int32)
+    elif node.get_attr('dtype') in _numpy_dtype_map:
+        return values[0].astype(_numpy_dtype_map[node.get_attr('dtype')])
+    return None
+
+
+def _eval_Fill(node, values):
+    value = node.get_attr('value') if 'value' in node.layer.attr else values[1]
+    value = np.asarray(value)
+    if value.dtype == np.float64:
+        value = value.astype(np.float32)
+    elif value.dtype == np.int64:
+        value = value.astype(np.int32)
+    return np.full(values[0].tolist(), value, dtype = value.dtype)
+
+
+_evaluators = {
+    'Add'           : _binary(np.add),
+    'Sub'           : _binary(np.subtract),
+    'Mul'           : _binary(np.multiply),
+    'Div'           : _binary(_div),
+    'RealDiv'       : _binary(_div),
+    'Maximum'       : _binary(np.maximum),
+    'Maxmum'        : _binary(np.maximum),
+    'Minimum'       : _binary(np.minimum),
+    'Neg'           : _unary(np.negative),
+    'Abs'           : _unary(np.abs),
+    'Square'        : _unary(np.square),
+    'Sqrt'          : _unary(np.sqrt),
+    'Rsqrt'         : _unary(lambda x: 1.0 / np.sqrt(x)),
+    'Exp'           : _unary(np.exp),
+    'Reshape'       : _eval_Reshape,
+    'Transpose'     : _eval_Transpose,
+    'Concat'        : _eval_Concat,
+    'Pack'          : _eval_Pack,
+    'Squeeze'       : _eval_Squeeze,
+    'Unsqueeze'     : _eval_Unsqueeze,
+    'Slice'         : _eval_Slice,
+    'StridedSlice'  : _eval_Slice,
+    'Cast'          : _eval_Cast,
+    'Fill'          : _eval_Fill,
+}
+
+# ops only reading the shape of their input
+_shape_ops = ('Shape', 'ZerosLike', 'OnesLike')
+
+
+@register_pass('fold_constants')
+class ConstantFoldingPass(Pass):
+    """Evaluates with NumPy the nodes whose inputs are all known at conversion time.
+
+    A node is folded when every input is a Constant, or for Shape, ZerosLike
+    and OnesLike when its input has a fully static shape. The node becomes a
+    Constant whose value is stored in weights_dict[name]['value'], keeping its
+    scope. Constants left without consumers are removed. Graph outputs and
+    nodes with weights of their own are never folded.
+
+    Options
+    -------
+    max_size: int, default 1 << 20
+        Largest folded value in elements, bigger results stay computed.
+    """
+
+    def run(self, graph, weights_dict):
+        max_size = self.options.get('max_size', 1 << 20)
+        folded = list()
+        for name in list(graph.topological_sort):
+            node = graph.layer_map.get(name)
+            if node is None or not node.out_edges or node.name in weights_dict:
+                continue
+
+            value = self._evaluate(graph, weights_dict, node)
+            if value is None or not value.dtype in _dtype_map or value.size > max_size:
+                continue
+
+            self._replace_with_constant(graph, weights_dict, node, value)
+            folded.append(name)
+
+        if folded:
+            graph.rebuild()
+        print("Folded [{}] nodes into constants.".format(len(folded)))
+
+
+    def _evaluate(self, graph, weights_dict, node):
+        if not node.in_edges or any(':' in edge and not edge.endswith(':0') for edge in node.in_edges):
+            return None
+        input_nodes = [graph.get_node(edge) for edge in node.in_edges]
+
+        if node.type in _shape_ops:
+            shape = _static_shape(input_nodes[0])
+            if node.type == 'Shape':
+                return None if shape is None else np.array(shape, dtype = np.int32)
+            value = _constant_value(input_nodes[0], weights_dict) if input_nodes[0].type == 'Constant' else None
+            dtype = value.dtype if value is not None else _numpy_dtype_map.get(node.get_attr('dtype'), np.float32)
+            if value is not None:
+                shape = value.shape
+            if shape is None:
+                return None
+            return np.zeros(shape, dtype) if node.type == 'ZerosLike' else np.ones(shape, dtype)
+
+        if not node.type in _evaluators or any(in_node.type != 'Constant' for in_node in input_nodes):
+            return None
+        values = [_constant_value(in_node, weights_dict) for in_node in input_nodes]
+        if any(value is None for value in values):
+            return None
+
+        try:
+            value = _evaluators[node.type](node, values)
+        except (ValueError, IndexError, TypeError) as e:
+            print("Warning: node [{}] of type [{}] is not folded: {}.".format(node.name, node.type, e))
+            return None
+        return None if value is None else np.asarray(value)
+
+
+    def _replace_with_constant(self, graph, weights_dict, node, value):
+        for edge in node.in_edges:
+            in_node = graph.get_node(edge)
+            in_node.out_edges = [name for name in in_node.out_edges if name != node.name]
+            if in_node.type == 'Constant' and not in_node.out_edges:
+                graph.delete_node(in_node)
+                weights_dict.pop(in_node.name, None)
+
+        node.in_edges = list()
+        del node.layer.input[:]
+
+        node.layer.op = 'Constant'
+        for attr in list(node.layer.attr):
+            if attr != 'scope':
+                del node.layer.attr[attr]
+        node.layer.attr['dtype'].type = _dtype_map[value.dtype]
+        node.layer.attr['_output_shapes'].list.shape.extend([list_to_shape(value.shape)])
+        weights_dict[node.name] = {'value' : value}
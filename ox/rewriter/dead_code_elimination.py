@@ -0,0 +1,76 @@
+import numpy as np
+from ox.common.utils import sizeof_fmt
+from ox.rewriter.pass_manager import Pass, register_pass
+
+
+def _weights_size(weights):
+    if isinstance(weights, dict):
+        return sum(_weights_size(value) for value in weights.values())
+    return weights.nbytes if isinstance(weights, np.ndarray) else 0
+
+
+@register_pass('eliminate_dead_nodes')
+class DeadNodeEliminationPass(Pass):
+    """Removes the nodes the graph outputs do not depend on, and their weights.
+
+    Nodes are kept when they are reachable backwards from the outputs. By
+    default the outputs are the output layers computed from the data of a
+    DataInput, so dangling Assert or CheckNumerics consumers, shape
+    computations left behind by the parsers and orphaned constants go away.
+    Weights of removed nodes, and of nodes IRGraph.filter_node dropped
+    before, are deleted from the weights dict. The removed nodes are kept in
+    self.removed and printed.
+
+    Options
+    -------
+    outputs: list
+        Names of the nodes to keep, with everything they depend on.
+
+    verbose: bool, default True
+        Print every removed node.
+    """
+
+    side_effect_types = ('Assert', 'CheckNumerics', 'NoOp', 'Print')
+
+    # ops whose result only depends on the shape of their inputs
+    shape_types = ('Shape', 'Size', 'Rank', 'ZerosLike', 'OnesLike')
+
+    def run(self, graph, weights_dict):
+        outputs = self.options.get('outputs') or self._default_outputs(graph)
+        live = set(node.name for node in graph.get_nodes_by_type('DataInput'))
+        stack = [graph.get_node(name).name for name in outputs]
+        while stack:
+            name = stack.pop()
+            if name in live:
+                continue
+            live.add(name)
+            stack.extend(edge.split(':')[0] for edge in graph.get_node(name).in_edges)
+
+        self.removed = [(name, node.type) for name, node in graph.layer_map.items() if not name in live]
+        for name, _ in self.removed:
+            graph.delete_node(graph.layer_map[name])
+        if self.removed:
+            graph.rebuild()
+
+        node_names = set(node.name for node in graph.model.node)
+        dead_weights = [name for name in weights_dict if name in node_names and not name in graph.layer_map]
+        freed = sum(_weights_size(weights_dict.pop(name)) for name in dead_weights)
+
+        print("Removed [{}] dead nodes and [{}] weights ({}).".format(len(self.removed), len(dead_weights), sizeof_fmt(freed)))
+        if self.options.get('verbose', True):
+            for name, node_type in self.removed:
+                print("    {} ({})".format(name, node_type))
+
+
+    def _default_outputs(self, graph):
+        # nodes computed from the data of an input, not only from its shape
+        data_nodes = set()
+        for name in graph.topological_sort:
+            node = graph.get_node(name)
+            if node.type == 'DataInput':
+                data_nodes.add(name)
+            elif not node.type in self.shape_types and any(edge.split(':')[0] in data_nodes for edge in node.in_edges):
+                data_nodes.add(name)
+
+        outputs = [name for name in graph.output_layers if not graph.get_node(name).type in self.side_effect_types]
+        return [name for name in outputs if name in data_nodes] or outputs
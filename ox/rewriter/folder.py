@@ -1,4 +1,5 @@
 from ox.common.IR.IR_graph import *
+from ox.rewriter.pass_manager import Pass, register_pass
 import sys
 import re
 import numpy as np
@@ -429,3 +430,10 @@ class Folder(object):
                                 pattern_weights[ir_node.pattern] = [self._weights_dict[inner_name]]
                                 ir_node.pattern = ir_node.pattern + '_'+ str(name_no_dict.get(ir_node.pattern, 0))
 
+
+@register_pass('fold_scopes')
+class FoldScopesPass(Pass):
+    """Folds the nodes sharing a scope into Scope nodes, options are the Folder arguments."""
+
+    def run(self, graph, weights_dict):
+        Folder(graph, weights_dict, **self.options).fold()
@@ -19,7 +19,8 @@ from __future__ import division
 from __future__ import print_function
 
 import abc
-import itertools
+import collections
+import time
 
 from ox.common.DataStructure.graph import Graph
 
@@ -29,8 +30,12 @@ class Pattern(object):
   """The parent class of all patterns (e.g. OpTypePattern and OneofPattern)."""
 
   @abc.abstractmethod
-  def match(self, op, tensor):
-    """Returns the result of matching op/tensor against this pattern."""
+  def match(self, op, memo=None):
+    """Returns the result of matching op against this pattern.
+
+    `memo` is an optional dict of (pattern, op) --> result shared by the
+    matches of one session, sub-patterns found in it are not matched again.
+    """
     raise NotImplementedError('Method "match" not implemented.')
 
 
@@ -54,17 +59,12 @@ class OpTypePattern(Pattern):
         any inputs of a matching op.
       ordered_inputs: Defaults to True. If False, will match any op that
         matches a permutation of the inputs.
-
-    Raises:
-      ValueError: if too many inputs are provided when order_inputs is False.
     """
     self._op_type = op_type
+    self._op_types = None if op_type == '*' else frozenset(op_type.split('|'))
     self._name = name
     if inputs is None:
       inputs = []
-    if len(inputs) > 8:
-      raise ValueError(
-          'Only < 8 inputs are allowed when ordered_inputs is False.')
     self._inputs = [
         input_pattern
         if isinstance(input_pattern, Pattern) else OpTypePattern(input_pattern)
@@ -93,39 +93,87 @@ class OpTypePattern(Pattern):
     op.scope = scope
 
 
-  def match(self, op):
-    if self._op_type != '*':
-      if op.type not in self._op_type.split('|'):
-        return None
-    
-    match_result = MatchResult()
-    match_result.add(self, op)
+  def match(self, op, memo=None):
+    # results are cached per (pattern, op) for the whole match session
+    if memo is None:
+      memo = {}
+    key = (self, op)
+    if key not in memo:
+      memo[key] = self._match(op, memo)
+    return memo[key]
+
+  def _match(self, op, memo):
+    if self._op_types is not None and op.type not in self._op_types:
+      return None
 
     if not self._inputs:
       # If pattern.inputs is empty, skips the rest and accepts all the inputs.
-      return match_result
+      return MatchResult(self, op)
 
     if len(op.in_edges) != len(self._inputs):
       return None
 
-    input_patterns_list = [self._inputs]
     # If order doesn't matter for the inputs, then make sure we match at least
     # one permutation of the inputs.
     if not self._ordered_inputs:
-      input_patterns_list = list(itertools.permutations(self._inputs))
-
-    for input_patterns in input_patterns_list:
-      match_failed = False
-
-      for input_op, input_pattern in zip(op.in_nodes, input_patterns):
-        input_match_result = input_pattern.match(input_op)
-        if input_match_result is None:
-          match_failed = True
-          break
-        match_result.merge_from(input_match_result)
-      if not match_failed:
-        return match_result
-    return None
+      input_match_results = self._match_unordered_inputs(op, memo)
+      if input_match_results is None:
+        return None
+      return MatchResult(self, op, input_match_results)
+
+    input_match_results = []
+    for input_op, input_pattern in zip(op.in_nodes, self._inputs):
+      input_match_result = input_pattern.match(input_op, memo)
+      if input_match_result is None:
+        return None
+      input_match_results.append(input_match_result)
+    return MatchResult(self, op, input_match_results)
+
+  def _match_unordered_inputs(self, op, memo):
+    """Assigns every input op to a distinct input pattern.
+
+    The input pattern x input op compatibility matrix is matched once per
+    pair (through `memo`), then a perfect bipartite matching is searched with
+    augmenting paths. That is O(n^3) instead of trying all n! orders. Free
+    patterns are taken first, so the inputs are kept in order when it fits.
+
+    Returns:
+      The match results of the inputs in input order, or None.
+    """
+    in_nodes = op.in_nodes
+    compatible = [[] for _ in in_nodes]  # input index --> [(pattern index, result)]
+    for input_idx, input_op in enumerate(in_nodes):
+      for pattern_idx, input_pattern in enumerate(self._inputs):
+        input_match_result = input_pattern.match(input_op, memo)
+        if input_match_result is not None:
+          compatible[input_idx].append((pattern_idx, input_match_result))
+      if not compatible[input_idx]:
+        return None
+
+    assigned = [None] * len(self._inputs)  # pattern index --> input index
+
+    def _augment(input_idx, visited):
+      for pattern_idx, _ in compatible[input_idx]:
+        if assigned[pattern_idx] is None:
+          assigned[pattern_idx] = input_idx
+          return True
+      for pattern_idx, _ in compatible[input_idx]:
+        if pattern_idx in visited:
+          continue
+        visited.add(pattern_idx)
+        if _augment(assigned[pattern_idx], visited):
+          assigned[pattern_idx] = input_idx
+          return True
+      return False
+
+    for input_idx in range(len(in_nodes)):
+      if not _augment(input_idx, set()):
+        return None
+
+    input_match_results = [None] * len(in_nodes)
+    for pattern_idx, input_idx in enumerate(assigned):
+      input_match_results[input_idx] = dict(compatible[input_idx])[pattern_idx]
+    return input_match_results
 
 
 class OneofPattern(Pattern):
@@ -134,9 +182,13 @@ class OneofPattern(Pattern):
   def __init__(self, sub_patterns):
     self._sub_patterns = sub_patterns
 
-  def match(self, op):
+  @property
+  def sub_patterns(self):
+    return self._sub_patterns
+
+  def match(self, op, memo=None):
     for sub_pattern in self._sub_patterns:
-      match_result = sub_pattern.match(op)
+      match_result = sub_pattern.match(op, memo)
       if match_result is not None:
         return match_result
     return None
@@ -167,18 +219,48 @@ class MatchResult(object):
   is `y1` not `y0`.
   """
 
-  def __init__(self):
-    self._pattern_to_op = {}
-    self._name_to_pattern = {}
+  __slots__ = ('_entries', '_merged', '_maps')
 
+  def __init__(self, pattern=None, op=None, merged=None):
+    # the maps are only built when they are read, partial results of a match
+    # just keep references to the results of their inputs
+    self._entries = [] if pattern is None else [(pattern, op)]
+    self._merged = [] if merged is None else merged
+    self._maps = None
+
+  @property
+  def _pattern_to_op(self):
+    return self._get_maps()[0]
+
+  @property
+  def _name_to_pattern(self):
+    return self._get_maps()[1]
+
+  def _get_maps(self):
+    if self._maps is None:
+      pattern_to_op = {}
+      name_to_pattern = {}
+      self._collect(pattern_to_op, name_to_pattern)
+      self._maps = (pattern_to_op, name_to_pattern)
+    return self._maps
+
+  def _collect(self, pattern_to_op, name_to_pattern):
+    # later results override earlier ones, same as merging them in order
+    for pattern, op in self._entries:
+      pattern_to_op[pattern] = op
+      if pattern.name is not None:
+        name_to_pattern[pattern.name] = pattern
+    for other in self._merged:
+      other._collect(pattern_to_op, name_to_pattern)  # pylint: disable=protected-access
 
   def add(self, pattern, op):
-    self._pattern_to_op[pattern] = op
     if pattern.name is not None:
-      if pattern.name in self._name_to_pattern:
-        raise ValueError(
-            'Name %s is already bound to another pattern' % pattern.name)
-      self._name_to_pattern[pattern.name] = pattern
+      for bound_pattern, _ in self._entries:
+        if bound_pattern.name == pattern.name and bound_pattern is not pattern:
+          raise ValueError(
+              'Name %s is already bound to another pattern' % pattern.name)
+    self._entries.append((pattern, op))
+    self._maps = None
 
 
   def _to_pattern(self, pattern_or_name):
@@ -212,10 +294,8 @@ class MatchResult(object):
   #   return op_tensor[1] if op_tensor else None
 
   def merge_from(self, other_match_result):
-    # pylint: disable=protected-access
-    self._pattern_to_op.update(other_match_result._pattern_to_op)
-    self._name_to_pattern.update(other_match_result._name_to_pattern)
-    # pylint: enable=protected-access
+    self._merged.append(other_match_result)
+    self._maps = None
 
 
 class GraphMatcher(object):
@@ -230,7 +310,7 @@ class GraphMatcher(object):
     """
     self._pattern = pattern
 
-  def _match_pattern(self, pattern, op):
+  def _match_pattern(self, pattern, op, memo=None):
     """Returns whether an TF expression rooted at `op` matches `pattern`.
 
     If there is a match, adds to `self._match_result` the matching op and tensor
@@ -246,24 +326,25 @@ class GraphMatcher(object):
     Returns:
       True if an TF expression rooted at `op` matches `pattern`.
     """
-    match_result = pattern.match(op)
+    match_result = pattern.match(op, memo)
     if match_result is None:
       return False
     self._match_result.merge_from(match_result)
     return True
 
-  def match_op(self, op):
+  def match_op(self, op, memo=None):
     """Matches `op` against `self._pattern`.
 
     Args:
       op: `tf.Operation` to match against the pattern.
+      memo: Optional dict of sub-pattern results shared with other calls.
 
     Returns:
       Returns a `MatchResult` if `op` matches the pattern; otherwise, returns
       None.
     """
     self._match_result = MatchResult()
-    if not self._match_pattern(self._pattern, op):
+    if not self._match_pattern(self._pattern, op, memo):
       return None
     return self._match_result
 
@@ -276,20 +357,107 @@ class GraphMatcher(object):
     Yields:
       `MatchResult` for each `tf.Operation` that matches the pattern.
     """
+    # one session for all ops, sub-patterns are matched once per op
+    memo = {}
     for op in ops:
-      match_result = self.match_op(op)
+      match_result = self.match_op(op, memo)
       if match_result:
         yield match_result
 
   def match_graph(self, graph):
     """Matches each operation in `graph` against `self._pattern`.
 
+    Only the nodes whose type fits the root of the pattern are tried, they are
+    looked up in the op type index of `graph`.
+
     Args:
-      graph: `tf.Graph` containing operations to match.
+      graph: `Graph` containing operations to match.
 
     Yields:
       `MatchResult` for each `tf.Operation` in `graph` that matches the pattern.
     """
+    op_types = _root_op_types(self._pattern)
+    if op_types is None:
+      ops = graph.get_nodes()
+    else:
+      ops = graph.get_nodes_by_type(sorted(op_types))
     # Python 3.3.2+ implements `yield from`, but for now:
-    for match_result in self.match_ops(graph.get_nodes()):
+    for match_result in self.match_ops(ops):
       yield match_result
+
+
+def _root_op_types(pattern):
+  """Returns the set of op types a root node of `pattern` can have, None for any."""
+  if isinstance(pattern, OpTypePattern):
+    if pattern.type == '*':
+      return None
+    return set(pattern.type.split('|'))
+
+  if isinstance(pattern, OneofPattern):
+    op_types = set()
+    for sub_pattern in pattern.sub_patterns:
+      sub_types = _root_op_types(sub_pattern)
+      if sub_types is None:
+        return None
+      op_types |= sub_types
+    return op_types
+
+  return None
+
+
+
+class MultiPatternMatcher(object):
+  """Matches several patterns in a single traversal of a graph.
+
+  Sub-pattern results are memoized per (pattern, op) for the whole traversal,
+  so sub-patterns shared between patterns, or repeated inside one pattern, are
+  matched once per op. The time spent on a shared sub-pattern is counted for
+  the pattern that matched it first.
+  """
+
+  def __init__(self, patterns):
+    """Initializes a MultiPatternMatcher.
+
+    Args:
+      patterns: OrderedDict of pattern name --> `Pattern`.
+    """
+    self._patterns = patterns
+    self._any_type = []   # names of the patterns whose root can be any op
+    self._by_type = {}    # op type --> names of the patterns rooted at it
+    for name, pattern in patterns.items():
+      op_types = _root_op_types(pattern)
+      if op_types is None:
+        self._any_type.append(name)
+      else:
+        for op_type in op_types:
+          self._by_type.setdefault(op_type, []).append(name)
+    self.timings = collections.OrderedDict((name, 0.0) for name in patterns)
+
+  def match_graph(self, graph):
+    """Matches every pattern against `graph` in one traversal.
+
+    Args:
+      graph: `Graph` containing operations to match.
+
+    Returns:
+      OrderedDict of pattern name --> list of `MatchResult`, in graph order.
+    """
+    memo = {}
+    results = collections.OrderedDict((name, []) for name in self._patterns)
+    if self._any_type:
+      ops = graph.get_nodes()
+    else:
+      ops = graph.get_nodes_by_type(sorted(self._by_type))
+
+    for op in ops:
+      for name in self._by_type.get(op.type, []) + self._any_type:
+        start = time.time()
+        match_result = self._patterns[name].match(op, memo)
+        self.timings[name] += time.time() - start
+        if match_result is not None:
+          results[name].append(match_result)
+    return results
+
+  def report(self):
+    for name, elapsed in self.timings.items():
+      print("Pattern [{}] matched in {:.3f} s.".format(name, elapsed))
@@ -0,0 +1,154 @@
+import importlib
+import time
+import tracemalloc
+from ox.common.utils import sizeof_fmt
+
+
+_pass_registry = dict()
+
+# passes shipped with ox, their modules are imported on first use
+_builtin_passes = {
+    'fold_batchnorm' : 'ox.rewriter.batchnorm_folding',
+    'fold_constants' : 'ox.rewriter.constant_folding',
+    'eliminate_dead_nodes' : 'ox.rewriter.dead_code_elimination',
+    'eliminate_common_subexpressions' : 'ox.rewriter.common_subexpression',
+    'eliminate_transposes' : 'ox.rewriter.transpose_elimination',
+    'fuse_activations' : 'ox.rewriter.activation_fusion',
+    'infer_shapes' : 'ox.common.IR.shape_inference',
+}
+
+
+def register_pass(name):
+    """Class decorator registering a Pass subclass under `name`."""
+    def _register(cls):
+        cls.name = name
+        _pass_registry[name] = cls
+        return cls
+    return _register
+
+
+def get_pass(name):
+    if not name in _pass_registry and name in _builtin_passes:
+        importlib.import_module(_builtin_passes[name])
+    if not name in _pass_registry:
+        raise ValueError("Pass [{}] is not registered. Registered passes: {}.".format(name, sorted(_pass_registry)))
+    return _pass_registry[name]
+
+
+class Pass(object):
+    """A graph transformation run by PassManager.
+
+    Passes change the graph and the weights dict in place. Options given to
+    the constructor are kept in self.options.
+    """
+
+    name = None
+
+    def __init__(self, **options):
+        self.options = options
+
+
+    def run(self, graph, weights_dict):
+        raise NotImplementedError()
+
+
+def _weights_snapshot(weights_dict):
+    # node name --> shallow copy of its weights, arrays are compared by identity
+    return dict((name, dict(weights) if isinstance(weights, dict) else weights) for name, weights in weights_dict.items())
+
+
+def _same_weights(snapshot, weights_dict):
+    if set(snapshot) != set(weights_dict):
+        return False
+    for name, weights in weights_dict.items():
+        before = snapshot[name]
+        if isinstance(weights, dict):
+            if not isinstance(before, dict) or set(before) != set(weights) or \
+               any(before[key] is not value for key, value in weights.items()):
+                return False
+        elif before is not weights:
+            return False
+    return True
+
+
+class PassStat(object):
+
+    def __init__(self, name, elapsed, nodes_before, nodes_after, peak_memory):
+        self.name = name
+        self.elapsed = elapsed
+        self.nodes_before = nodes_before
+        self.nodes_after = nodes_after
+        self.peak_memory = peak_memory
+
+
+    def __str__(self):
+        memory = sizeof_fmt(self.peak_memory) if self.peak_memory is not None else "-"
+        return "Pass [{}] took {:.3f} s, nodes {} -> {} ({:+d}), peak memory {}.".format(
+            self.name, self.elapsed, self.nodes_before, self.nodes_after,
+            self.nodes_after - self.nodes_before, memory)
+
+
+class PassManager(object):
+    """Runs an ordered list of passes over a graph and records what each one costs.
+
+    Parameters
+    ----------
+    passes: list
+        Registered pass names or Pass instances, run in order.
+
+    options: dict
+        pass name --> options for the passes given by name.
+
+    trace_memory: bool
+        Record the peak Python memory allocated by each pass with tracemalloc.
+        It slows the passes down, so it is off unless asked for.
+
+    After run, weights_changed tells whether a pass added, removed or replaced
+    weights, which then have to be saved along with the converted model.
+    """
+
+    def __init__(self, passes, options = None, trace_memory = False):
+        options = options or dict()
+        self.passes = list()
+        for item in passes:
+            if isinstance(item, Pass):
+                self.passes.append(item)
+            else:
+                self.passes.append(get_pass(item)(**options.get(item, dict())))
+        self.trace_memory = trace_memory
+        self.stats = list()
+        self.weights_changed = False
+
+
+    def run(self, graph, weights_dict):
+        snapshot = _weights_snapshot(weights_dict)
+        for ir_pass in self.passes:
+            nodes_before = len(graph.layer_map)
+            peak_memory = None
+
+            started = self.trace_memory and not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            if self.trace_memory:
+                base_memory = tracemalloc.get_traced_memory()[0]
+                if hasattr(tracemalloc, 'reset_peak'):
+                    tracemalloc.reset_peak()
+
+            start = time.time()
+            ir_pass.run(graph, weights_dict)
+            elapsed = time.time() - start
+
+            if self.trace_memory:
+                peak_memory = max(tracemalloc.get_traced_memory()[1] - base_memory, 0)
+            if started:
+                tracemalloc.stop()
+
+            self.stats.append(PassStat(ir_pass.name, elapsed, nodes_before, len(graph.layer_map), peak_memory))
+
+        self.weights_changed = self.weights_changed or not _same_weights(snapshot, weights_dict)
+        return graph
+
+
+    def report(self):
+        for stat in self.stats:
+            print(stat)
@@ -27,7 +27,11 @@ class UnitRewriterBase(object):
     def _rewrite_graph_by_pattern(self, pattern_name, graph_type):
         pattern = rnn_patterns[graph_type][pattern_name]
         matcher = GraphMatcher(pattern)
-        match_results = list(matcher.match_ops(self._graph.get_nodes()))
+        match_results = list(matcher.match_graph(self._graph))
+        self.rewrite_match_results(pattern_name, match_results)
+
+
+    def rewrite_match_results(self, pattern_name, match_results):
         scope_names_dict = dict() # name: No.
 
         for i in range(len(match_results)):
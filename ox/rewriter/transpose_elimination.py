@@ -0,0 +1,180 @@
+import numpy as np
+from ox.common.utils import shape_to_list, list_to_shape
+from ox.rewriter.pass_manager import Pass, register_pass
+
+
+def _extend(perm, rank):
+    return list(perm) + list(range(len(perm), rank))
+
+
+def _compose(first, second):
+    """Permutation of transpose(transpose(x, first), second)."""
+    rank = max(len(first), len(second))
+    first, second = _extend(first, rank), _extend(second, rank)
+    return [first[axis] for axis in second]
+
+
+def _is_identity(perm):
+    return list(perm) == list(range(len(perm)))
+
+
+@register_pass('eliminate_transposes')
+class TransposeEliminationPass(Pass):
+    """Removes layout round trips made of Transpose nodes.
+
+    A Transpose is moved down through the chain of layout-agnostic ops between
+    it and the next Transpose when it is their only input, then both are
+    composed into one Transpose, which is removed if the composed permutation
+    is the identity. Transposes reading a Constant permutation get it as a
+    'perm' attr.
+
+    Only paired transposes are removed: the layout is not propagated through
+    convs, pools or other layout-dependent ops, so a single NCHW <-> NHWC
+    Transpose with no partner stays in the graph.
+
+    Options
+    -------
+    fold_input_transpose: bool, default False
+        Remove the Transpose right after a DataInput by permuting the input
+        shape instead, so the converted model takes its input in the layout
+        of the target framework. Only a Transpose directly consuming the
+        DataInput is folded.
+    """
+
+    # elementwise ops without weights, their result does not depend on the layout
+    layout_agnostic_types = ('Relu', 'Relu6', 'Sigmoid', 'Tanh', 'Elu', 'Selu', 'Softplus', 'LeakyRelu',
+                             'Abs', 'Neg', 'Exp', 'Sqrt', 'Rsqrt', 'Square', 'Dropout', 'Identity', 'Cast')
+
+    def run(self, graph, weights_dict):
+        removed = 0
+        changed = True
+        while changed:
+            changed = False
+            for node in graph.get_nodes_by_type('Transpose'):
+                if not node.name in graph.layer_map:
+                    continue
+                ret = self._eliminate(graph, weights_dict, node)
+                if ret:
+                    removed += ret
+                    changed = True
+
+        if self.options.get('fold_input_transpose', False):
+            for input_node in graph.get_nodes_by_type('DataInput'):
+                removed += self._fold_input_transpose(graph, weights_dict, input_node)
+
+        if removed:
+            graph.rebuild()
+        print("Removed [{}] Transpose nodes.".format(removed))
+
+
+    def _get_perm(self, graph, weights_dict, node):
+        if node.get_attr('scope') or len(node.in_edges) > 2:
+            return None
+        if len(node.in_edges) == 2:
+            perm_node = graph.get_node(node.in_edges[1])
+            if perm_node.type != 'Constant':
+                return None
+            if perm_node.name in weights_dict and 'value' in weights_dict[perm_node.name]:
+                return np.asarray(weights_dict[perm_node.name]['value']).tolist()
+            return perm_node.get_attr('value')
+
+        if node.get_attr('perm'):
+            return node.get_attr('perm')
+        # pytorch transpose(dim0, dim1), transpose(1, 2) when not given
+        dims = node.get_attr('perm_list') or [1, 2]
+        perm = list(range(max(dims) + 1))
+        perm[dims[0]], perm[dims[1]] = perm[dims[1]], perm[dims[0]]
+        return perm
+
+
+    def _set_perm(self, graph, weights_dict, node, perm):
+        if len(node.in_edges) == 2:
+            perm_node = graph.get_node(node.in_edges[1])
+            node.in_edges = node.in_edges[:1]
+            del node.layer.input[1:]
+            perm_node.out_edges = [name for name in perm_node.out_edges if name != node.name]
+            if not perm_node.out_edges:
+                graph.delete_node(perm_node)
+                weights_dict.pop(perm_node.name, None)
+
+        for attr in ('perm', 'perm_list'):
+            if attr in node.layer.attr:
+                del node.layer.attr[attr]
+        node.layer.attr['perm'].list.i.extend(perm)
+
+
+    def _eliminate(self, graph, weights_dict, node):
+        perm = self._get_perm(graph, weights_dict, node)
+        if perm is None or not node.out_edges:
+            return 0
+
+        if _is_identity(perm):
+            self._remove(graph, weights_dict, node)
+            return 1
+
+        # walk up the layout-agnostic chain to the previous Transpose
+        chain = list()
+        current = graph.get_node(node.in_edges[0])
+        while current.type in self.layout_agnostic_types and len(current.in_edges) == 1 and \
+              len(current.out_edges) == 1 and not current.name in weights_dict and not current.get_attr('scope'):
+            chain.insert(0, current)
+            current = graph.get_node(current.in_edges[0])
+
+        if current.type != 'Transpose' or len(current.out_edges) != 1 or ':' in node.in_edges[0]:
+            return 0
+        first_perm = self._get_perm(graph, weights_dict, current)
+        if first_perm is None:
+            return 0
+
+        # the chain now reads the input of the first Transpose
+        source = current.in_edges[0]
+        if chain:
+            head = chain[0]
+            graph.replace_input(head, current.name, source)
+            shapes = graph.get_node(source).get_attr('_output_shapes')
+            for chain_node in chain:
+                if shapes:
+                    del chain_node.layer.attr['_output_shapes'].list.shape[:]
+                    chain_node.layer.attr['_output_shapes'].list.shape.extend(shapes[:1])
+        else:
+            graph.replace_input(node, current.name, source)
+        self._remove(graph, weights_dict, current)
+
+        perm = _compose(first_perm, perm)
+        if _is_identity(perm):
+            self._remove(graph, weights_dict, node)
+            return 2
+
+        self._set_perm(graph, weights_dict, node, perm)
+        return 1
+
+
+    def _fold_input_transpose(self, graph, weights_dict, input_node):
+        if len(input_node.out_edges) != 1:
+            return 0
+        node = graph.get_node(input_node.out_edges[0])
+        if node.type != 'Transpose':
+            return 0
+        perm = self._get_perm(graph, weights_dict, node)
+        shape = shape_to_list(input_node.layer.attr['shape'].shape) if 'shape' in input_node.layer.attr else None
+        if perm is None or not shape or len(perm) > len(shape):
+            return 0
+
+        shape = [shape[axis] for axis in _extend(perm, len(shape))]
+        input_node.layer.attr['shape'].shape.CopyFrom(list_to_shape(shape))
+        shapes = node.get_attr('_output_shapes')
+        if shapes:
+            del input_node.layer.attr['_output_shapes'].list.shape[:]
+            input_node.layer.attr['_output_shapes'].list.shape.extend(shapes[:1])
+
+        self._remove(graph, weights_dict, node)
+        return 1
+
+
+    def _remove(self, graph, weights_dict, node):
+        perm_node = graph.get_node(node.in_edges[1]) if len(node.in_edges) == 2 else None
+        graph.bypass_node(node)
+        weights_dict.pop(node.name, None)
+        if perm_node is not None and not perm_node.out_edges:
+            graph.delete_node(perm_node)
+            weights_dict.pop(perm_node.name, None)
@@ -1,9 +1,34 @@
+import collections
 from ox.rewriter.rewriter import UnitRewriterBase
+from ox.rewriter.graph_matcher import MultiPatternMatcher
+from ox.rewriter.pass_manager import Pass, register_pass
+from ox.rewriter.rnn_utils import rnn_patterns
 from ox.tensorflow.rewriter.gru_rewriter import GRURewriter
 from ox.tensorflow.rewriter.lstm_rewriter import LSTMRewriter
 
 def process_graph(graph, weights):
     rewriter_list = [GRURewriter, LSTMRewriter]
+    rewriters = [rewriter(graph, weights) for rewriter in rewriter_list]
 
-    for rewriter in rewriter_list:
-        rewriter(graph, weights).run()
\ No newline at end of file
+    # every pattern is matched in a single traversal, rewriters only set scopes
+    # and kwargs so the results stay valid while they are processed in order
+    patterns = collections.OrderedDict()
+    for rewriter in rewriters:
+        for pattern_name in rewriter.pattern_names:
+            patterns[pattern_name] = rnn_patterns['tensorflow'][pattern_name]
+
+    matcher = MultiPatternMatcher(patterns)
+    match_results = matcher.match_graph(graph)
+    matcher.report()
+
+    for rewriter in rewriters:
+        for pattern_name in rewriter.pattern_names:
+            rewriter.rewrite_match_results(pattern_name, match_results[pattern_name])
+
+
+@register_pass('tensorflow_rnn')
+class RnnRewritePass(Pass):
+    """Marks the scopes of the GRU and LSTM cells of a TensorflowGraph."""
+
+    def run(self, graph, weights_dict):
+        process_graph(graph, weights_dict)
@@ -0,0 +1,212 @@
+import mmap
+import numpy as np
+import tensorflow
+
+
+# Field numbers of the messages on the path GraphDef.node[].attr[].tensor.tensor_content
+_GRAPH_NODE = 1
+_NODE_NAME = 1
+_NODE_ATTR = 5
+_ATTR_ENTRY_VALUE = 2
+_ATTR_VALUE_TENSOR = 8
+_TENSOR_DTYPE = 1
+_TENSOR_CONTENT = 4
+
+_WIRE_VARINT = 0
+_WIRE_FIXED64 = 1
+_WIRE_LENGTH = 2
+_WIRE_FIXED32 = 5
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _encode_varint(value):
+    ret = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            ret.append(byte | 0x80)
+        else:
+            ret.append(byte)
+            return bytes(ret)
+
+
+def _iter_fields(buf, start, end):
+    """Yield (field_number, wire_type, field_start, value_start, value_end) for a serialized message."""
+    pos = start
+    while pos < end:
+        field_start = pos
+        tag, pos = _read_varint(buf, pos)
+        field_number, wire_type = tag >> 3, tag & 7
+        if wire_type == _WIRE_VARINT:
+            _, value_end = _read_varint(buf, pos)
+        elif wire_type == _WIRE_FIXED64:
+            value_end = pos + 8
+        elif wire_type == _WIRE_LENGTH:
+            length, pos = _read_varint(buf, pos)
+            value_end = pos + length
+        elif wire_type == _WIRE_FIXED32:
+            value_end = pos + 4
+        else:
+            raise ValueError("Unsupported wire type [%d] at offset [%d]." % (wire_type, field_start))
+        yield field_number, wire_type, field_start, pos, value_end
+        pos = value_end
+
+
+def _length_field(field_number, payload):
+    return _encode_varint(field_number << 3 | _WIRE_LENGTH) + _encode_varint(len(payload)) + payload
+
+
+class ExternalTensor(object):
+    """Location of a Const tensor_content payload inside the mapped graph file."""
+
+    def __init__(self, dtype, offset, length):
+        self.dtype = dtype
+        self.offset = offset
+        self.length = length
+
+
+class GraphDefReader(object):
+    """Memory-mapped reader for frozen GraphDef files.
+
+    Only the graph structure is parsed by protobuf. tensor_content payloads
+    of Const nodes larger than `threshold` bytes are cut out of the
+    serialized nodes and kept as offsets into the mapping, so files beyond
+    protobuf's 2 GB message limit can be loaded and their weights are only
+    paged in when they are read.
+
+    The reader is a context manager. Arrays returned by get_tensor are views
+    of the mapping, it is unmapped on close or, if such views are still
+    alive then, when the last of them goes away.
+    """
+
+    def __init__(self, filename, threshold = 64 * 1024):
+        self.threshold = threshold
+        # the mapping keeps its own descriptor
+        with open(filename, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        self.tensors = dict()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        if self._mmap is None:
+            return
+        try:
+            self._mmap.close()
+        except BufferError:
+            # tensor views are still exported, the mapping is released with them
+            pass
+        self._mmap = None
+
+
+    def load(self):
+        """Return the GraphDef with large tensor contents stripped out."""
+        buf = self._mmap
+        chunks = list()
+        for field_number, wire_type, field_start, start, end in _iter_fields(buf, 0, len(buf)):
+            if field_number == _GRAPH_NODE and wire_type == _WIRE_LENGTH:
+                chunks.append(_length_field(_GRAPH_NODE, self._strip_node(start, end)))
+            else:
+                chunks.append(buf[field_start:end])
+
+        graph_def = tensorflow.GraphDef()
+        graph_def.ParseFromString(b''.join(chunks))
+        return graph_def
+
+
+    def _strip_node(self, start, end):
+        buf = self._mmap
+        name = None
+        chunks = list()
+        stripped = None
+        for field_number, wire_type, field_start, value_start, value_end in _iter_fields(buf, start, end):
+            if field_number == _NODE_NAME:
+                name = buf[value_start:value_end].decode('utf-8')
+
+            if field_number == _NODE_ATTR and value_end - value_start > self.threshold:
+                entry, tensor = self._strip_attr_entry(value_start, value_end)
+                if tensor:
+                    stripped = tensor
+                    chunks.append(_length_field(_NODE_ATTR, entry))
+                    continue
+
+            chunks.append(buf[field_start:value_end])
+
+        if stripped:
+            self.tensors[name] = stripped
+        return b''.join(chunks)
+
+
+    def _strip_attr_entry(self, start, end):
+        buf = self._mmap
+        chunks = list()
+        tensor = None
+        for field_number, wire_type, field_start, value_start, value_end in _iter_fields(buf, start, end):
+            if field_number == _ATTR_ENTRY_VALUE:
+                value, tensor = self._strip_attr_value(value_start, value_end)
+                if tensor:
+                    chunks.append(_length_field(_ATTR_ENTRY_VALUE, value))
+                    continue
+            chunks.append(buf[field_start:value_end])
+        return b''.join(chunks), tensor
+
+
+    def _strip_attr_value(self, start, end):
+        buf = self._mmap
+        chunks = list()
+        tensor = None
+        for field_number, wire_type, field_start, value_start, value_end in _iter_fields(buf, start, end):
+            if field_number == _ATTR_VALUE_TENSOR:
+                value, tensor = self._strip_tensor(value_start, value_end)
+                if tensor:
+                    chunks.append(_length_field(_ATTR_VALUE_TENSOR, value))
+                    continue
+            chunks.append(buf[field_start:value_end])
+        return b''.join(chunks), tensor
+
+
+    def _strip_tensor(self, start, end):
+        buf = self._mmap
+        chunks = list()
+        dtype = None
+        content = None
+        for field_number, wire_type, field_start, value_start, value_end in _iter_fields(buf, start, end):
+            if field_number == _TENSOR_DTYPE and wire_type == _WIRE_VARINT:
+                dtype, _ = _read_varint(buf, value_start)
+            if field_number == _TENSOR_CONTENT and value_end - value_start > self.threshold:
+                content = (value_start, value_end - value_start)
+                continue
+            chunks.append(buf[field_start:value_end])
+
+        if content is None:
+            return None, None
+        return b''.join(chunks), ExternalTensor(dtype, content[0], content[1])
+
+
+    def get_tensor(self, name, shape):
+        """Return a read-only ndarray view of the external tensor of node `name`."""
+        if self._mmap is None:
+            raise ValueError("GraphDefReader is closed, tensor [{}] cannot be read.".format(name))
+        tensor = self.tensors[name]
+        dtype = tensorflow.as_dtype(tensor.dtype).as_numpy_dtype
+        count = tensor.length // np.dtype(dtype).itemsize
+        return np.frombuffer(self._mmap, dtype = dtype, count = count, offset = tensor.offset).reshape(shape)
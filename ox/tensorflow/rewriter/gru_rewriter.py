@@ -4,6 +4,8 @@ import re
 
 class GRURewriter(UnitRewriterBase):
 
+    pattern_names = ['gru_cell', 'h_zero']
+
     def __init__(self, graph, weights_dict):
         return super(GRURewriter, self).__init__(graph, weights_dict)
     
@@ -71,4 +73,4 @@ class GRURewriter(UnitRewriterBase):
 
 
     def run(self):
-        return super(GRURewriter, self).run(['gru_cell', 'h_zero'], 'tensorflow')
\ No newline at end of file
+        return super(GRURewriter, self).run(self.pattern_names, 'tensorflow')
\ No newline at end of file
@@ -5,6 +5,8 @@ import re
 
 class LSTMRewriter(UnitRewriterBase):
 
+    pattern_names = ['lstm_cell', 'h_zero']
+
     def __init__(self, graph, weights_dict):
         return super(LSTMRewriter, self).__init__(graph, weights_dict)
 
@@ -76,4 +78,4 @@ class LSTMRewriter(UnitRewriterBase):
 
 
     def run(self):
-        return super(LSTMRewriter, self).run(['lstm_cell', 'h_zero'], 'tensorflow')
\ No newline at end of file
+        return super(LSTMRewriter, self).run(self.pattern_names, 'tensorflow')
\ No newline at end of file
@@ -8,10 +8,29 @@ from ox.common.IR.graph_pb2 import NodeDef, GraphDef, DataType
 from ox.common.DataStructure.emitter import Emitter
 from ox.common.utils import *
 from ox.rewriter.folder import Folder
+from ox.rewriter.pass_manager import PassManager
 
 
 class TensorflowEmitter(Emitter):
 
+    # IR passes run before the code is generated, infer_shapes after the rewrites so the
+    # emitter reads shapes of the rewritten graph
+    passes = ['fold_constants', 'eliminate_transposes', 'eliminate_common_subexpressions', 'eliminate_dead_nodes',
+              'fuse_activations', 'infer_shapes', 'fold_scopes']
+
+    # activations for the fused_activation attr of Conv, DepthwiseConv and FullyConnected
+    fused_activation_map = {
+        'Relu'    : "tf.nn.relu",
+        'Relu6'   : "tf.nn.relu6",
+        'Elu'     : "tf.nn.elu",
+        'Sigmoid' : "tf.sigmoid",
+        'Tanh'    : "tf.tanh",
+    }
+
+    # constants from the weights with at most this many elements, like the values made by
+    # fold_constants, are written into the code instead of being read from the weights file
+    inline_constant_size = 64
+
     dtype_map = {
         graph_pb2.DT_FLOAT16 : "tf.float16",
         graph_pb2.DT_FLOAT32 : "tf.float32",
@@ -53,7 +72,7 @@ def KitModel(weight_file = None):
 """.format(self.trainable)
 
 
-    def __init__(self, model):
+    def __init__(self, model, passes = None, plan_memory = False, trace_memory = False, fold_batchnorm = False):
         super(TensorflowEmitter, self).__init__()
 
         from six import string_types as _string_types
@@ -66,8 +85,20 @@ def KitModel(weight_file = None):
         self.IR_graph = IRGraph(network_path)
         super(TensorflowEmitter, self)._build()
         
-        folder = Folder(self.IR_graph, self.weights_dict)
-        folder.fold()
+        self.pass_manager = PassManager(self._get_passes(passes, fold_batchnorm), trace_memory = trace_memory)
+        self.pass_manager.run(self.IR_graph, self.weights_dict)
+        self.pass_manager.report()
+        if plan_memory:
+            self._plan_memory()
+
+    def run(self, dstNetworkPath, dstWeightPath = None, phase = 'test'):
+        # IR passes may have changed the weights, the generated code has to load these ones
+        if self.pass_manager.weights_changed and not dstWeightPath:
+            raise ValueError("IR passes changed the weights, give a weight path to save them and load the converted model with it.")
+        super(TensorflowEmitter, self).run(dstNetworkPath, dstWeightPath, phase)
+        if dstWeightPath and (self.weight_loaded or self.pass_manager.weights_changed):
+            self.save_weights(self.weights_dict, dstWeightPath)
+
 
     def gen_code(self, phase):
         self.trainable = (phase == 'train')
@@ -123,15 +154,23 @@ def KitModel(weight_file = None):
         strides_str = ', '.join('%s' % i for i in IR_node.get_attr('strides')[1:-1])
         input_node, padding = self._defuse_padding(IR_node)
         data_format = IR_node.get_attr('data_format')
-        code = "{:<15} = convolution({}, group={}, strides=[{}], padding='{}', name='{}')".format(
+        code = "{:<15} = {}".format(
             IR_node.variable_name,
-            input_node,
-            IR_node.get_attr('group', 1),
-            strides_str,
-            padding,
-            IR_node.name)
+            self._fuse_activation(IR_node, "convolution({}, group={}, strides=[{}], padding='{}', name='{}')".format(
+                input_node,
+                IR_node.get_attr('group', 1),
+                strides_str,
+                padding,
+                IR_node.name)))
         return code
 
+
+    def _fuse_activation(self, IR_node, code):
+        activation = IR_node.get_attr('fused_activation')
+        if activation is None:
+            return code
+        return "{}({})".format(self.fused_activation_map[activation], code)
+
     def _defuse_padding(self, IR_node, extra_str=""):
         auto_pad = IR_node.get_attr('auto_pad')
         if auto_pad:
@@ -175,10 +214,18 @@ def KitModel(weight_file = None):
             # code = "{:<15} = {}".format(
             #         IR_node.variable_name,
             #         IR_node.get_attr('value'))
+            value = self.weights_dict.get(IR_node.name, dict()).get('value')
             if not isinstance(IR_node.get_attr('value'), list) and IR_node.get_attr('value') is not None:
                 code = "{:<15} = {}".format(
                     IR_node.variable_name,
                     IR_node.get_attr('value'))
+            elif IR_node.get_attr('value') is None and value is not None and value.size <= self.inline_constant_size:
+                code = "{:<15} = tf.constant({}, dtype={}, shape={}, name='{}')".format(
+                    IR_node.variable_name,
+                    value.reshape(-1).tolist(),
+                    dtype_str,
+                    list(value.shape),
+                    IR_node.name)
             else:
                 code = "{:<15} = tf.constant({}, dtype={}, name='{}')".format(
                     IR_node.variable_name,
@@ -298,6 +345,9 @@ def KitModel(weight_file = None):
             bias_str = "bias_initializer = tf.constant_initializer(__weights_dict['{}']['bias']), ".format(IR_node.name)
         else: bias_str = ""
 
+        if IR_node.get_attr('fused_activation') is not None:
+            bias_str += "activation = {}, ".format(self.fused_activation_map[IR_node.get_attr('fused_activation')])
+
         # check whether flatten operator should be added
         parent = self.IR_graph.get_parent(IR_node.name, [0])
         parent_shape = shape_to_list(parent.get_attr('_output_shapes')[0])
@@ -376,10 +426,14 @@ def KitModel(weight_file = None):
         return code
 
     def emit_Transpose(self, IR_node):
+        if len(IR_node.in_edges) > 1:
+            perm = self.parent_variable_name(IR_node, [1])
+        else:
+            perm = IR_node.get_attr('perm')
         code ="{:<15} = tf.transpose(a = {}, perm = {})".format(
             IR_node.variable_name,
             self.parent_variable_name(IR_node, [0]),
-            self.parent_variable_name(IR_node, [1]))
+            perm)
         
         return code
 
@@ -492,7 +546,13 @@ def KitModel(weight_file = None):
         return code
 
     def emit_LSTM(self, IR_node):
-        return self.emit_RNNs(IR_node, "LSTM")
+        self.used_layers.add(IR_node.type)
+        code = "{:<15} = lstm({}, hidden_size={}, name='{}')".format(
+            IR_node.variable_name,
+            self.parent_variable_name(IR_node),
+            IR_node.get_attr('hidden_size'),
+            IR_node.name)
+        return code
 
 
     def emit_GRU(self, IR_node):
@@ -592,12 +652,13 @@ def KitModel(weight_file = None):
         self.used_layers.add(IR_node.type)
         strides_str = ', '.join('%s' % i for i in IR_node.layer.attr['strides'].list.i)
         input_node, padding = self._defuse_padding(IR_node)
-        code = "{:<15} = depthwise_convolution({}, strides = [{}], padding = '{}', name = '{}')".format(
+        code = "{:<15} = {}".format(
             IR_node.variable_name,
-            input_node,
-            strides_str,
-            padding,
-            IR_node.name)
+            self._fuse_activation(IR_node, "depthwise_convolution({}, strides = [{}], padding = '{}', name = '{}')".format(
+                input_node,
+                strides_str,
+                padding,
+                IR_node.name)))
         return code
 
     def emit_Crop(self, IR_node):
@@ -846,6 +907,34 @@ def convolution(input, name, group, **kwargs):
     return layer""")
 
 
+    def _layer_LSTM(self):
+        self.add_body(0, """
+def lstm(input, name, hidden_size):
+    import numpy as np
+
+    # IR keeps PyTorch gate order (i, f, g, o), LSTMBlockFusedCell expects (i, g, f, o)
+    def reorder(w):
+        i, f, g, o = np.split(w, 4)
+        return np.concatenate([i, g, f, o])
+
+    weights = __weights_dict[name]
+    kernel = reorder(np.concatenate([weights['weights_ih'], weights['weights_hh']], axis=1)).transpose()
+    bias = reorder(weights['bias_ih'] + weights['bias_hh']) if 'bias_ih' in weights else np.zeros(4 * hidden_size, dtype=kernel.dtype)
+    def getter(getter, var_name, *args, **kwargs):
+        if var_name.endswith('kernel'):
+            kwargs.update(initializer=tf.constant_initializer(kernel), shape=kernel.shape)
+        elif var_name.endswith('bias'):
+            kwargs.update(initializer=tf.constant_initializer(bias), shape=bias.shape)
+        kwargs['trainable'] = is_train
+        return getter(var_name, *args, **kwargs)
+
+    with tf.variable_scope(name, custom_getter=getter):
+        # input is time major, [seq_len, batch, input_size]
+        cell = tf.contrib.rnn.LSTMBlockFusedCell(hidden_size, forget_bias=0.0)
+        output, _ = cell(input, dtype=input.dtype)
+    return output""")
+
+
     def _layer_PRelu(self):
         self.add_body(0, """
 def prelu(input, name):
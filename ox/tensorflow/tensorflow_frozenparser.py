@@ -10,6 +10,7 @@ import ox.common.IR.graph_pb2 as graph_pb2
 from ox.common.IR.graph_pb2 import NodeDef, GraphDef, DataType
 from ox.common.utils import *
 from ox.common.DataStructure.parser import Parser
+from ox.tensorflow.graphdef_reader import GraphDefReader
 from distutils.version import LooseVersion
 import tempfile
 import os
@@ -108,7 +109,10 @@ class TensorflowParser2(Parser):
     def src_graph(self):
         return self.tf_graph
 
-    def __init__(self, frozen_file, inputshape, in_nodes, dest_nodes):
+    # frozen graphs from this size on are read through a memory mapping by default
+    external_data_size = 2 * 1024 ** 3
+
+    def __init__(self, frozen_file, inputshape, in_nodes, dest_nodes, external_data = None):
         if LooseVersion(tensorflow.__version__) < LooseVersion('1.8.0'):
             raise ImportError(
                 'Your TensorFlow version %s is outdated. '
@@ -118,12 +122,19 @@ class TensorflowParser2(Parser):
 
         self.weight_loaded = True
         # load model files into TensorFlow graph
-        with open(frozen_file, 'rb') as f:
-            serialized = f.read()
-        tensorflow.reset_default_graph()
-        original_gdef = tensorflow.GraphDef()
+        if external_data is None:
+            external_data = os.path.getsize(frozen_file) >= TensorflowParser2.external_data_size
 
-        original_gdef.ParseFromString(serialized)
+        tensorflow.reset_default_graph()
+        if external_data:
+            self.graph_reader = GraphDefReader(frozen_file)
+            original_gdef = self.graph_reader.load()
+        else:
+            self.graph_reader = None
+            with open(frozen_file, 'rb') as f:
+                serialized = f.read()
+            original_gdef = tensorflow.GraphDef()
+            original_gdef.ParseFromString(serialized)
 
         in_type_list = {}
         for n in original_gdef.node:
@@ -151,6 +162,17 @@ class TensorflowParser2(Parser):
         model = tensorflow.GraphDef()
         model.ParseFromString(serialized)
 
+        # external tensors are imported as placeholders so that their content is never materialized
+        external_values = dict()
+        if self.graph_reader:
+            for node in model.node:
+                if node.name in self.graph_reader.tensors:
+                    external_values[node.name] = attr_value_pb2.AttrValue()
+                    external_values[node.name].CopyFrom(node.attr['value'])
+                    node.op = 'Placeholder'
+                    node.attr['shape'].shape.CopyFrom(node.attr['value'].tensor.tensor_shape)
+                    del node.attr['value']
+
         output_shape_map = dict()
         input_shape_map = dict()
         dtype = tensorflow.float32
@@ -179,6 +201,12 @@ class TensorflowParser2(Parser):
             model = meta_graph_def.graph_def
             shutil.rmtree((tempdir))
 
+        for node in model.node:
+            if node.name in external_values:
+                node.op = 'Const'
+                del node.attr['shape']
+                node.attr['value'].CopyFrom(external_values[node.name])
+
         self.tf_graph = TensorflowGraph(model)
         self.tf_graph.build()
 
@@ -188,6 +216,15 @@ class TensorflowParser2(Parser):
         return layer_name.split('/')
 
 
+    def _get_const_value(self, node):
+        value = node.get_attr('value')
+        if self.graph_reader and node.name in self.graph_reader.tensors:
+            shape = [dim.size for dim in value.tensor_shape.dim]
+            return self.graph_reader.get_tensor(node.name, shape)
+
+        return tensor_util.MakeNdarray(value)
+
+
     def check_const(self, node):
         while node:
             if node.type == "Const":
@@ -226,14 +263,12 @@ class TensorflowParser2(Parser):
 
             # A
             input_mul_A = self.get_parent(source_node.name, [0, 1])
-            tensor_content = input_mul_A.get_attr('value')
-            A_content = tensor_util.MakeNdarray(tensor_content)
+            A_content = self._get_const_value(input_mul_A)
             self.set_weight(source_node.name, 'A', A_content)
 
             # b
             input_sub = self.get_parent(source_node.name, [1])
-            tensor_content = input_sub.get_attr('value')
-            sub_content = tensor_util.MakeNdarray(tensor_content)
+            sub_content = self._get_const_value(input_sub)
             # print(sub_content)
             self.set_weight(source_node.name, 'b', sub_content)
 
@@ -252,8 +287,7 @@ class TensorflowParser2(Parser):
 
             if moving_variance.type == 'Identity':
                 moving_variance_read = self.src_graph.get_parent(moving_variance.name, [0])
-                tensor_content = moving_variance_read.get_attr('value')
-                moving_variance_content = tensor_util.MakeNdarray(tensor_content)
+                moving_variance_content = self._get_const_value(moving_variance_read)
                 self.set_weight(source_node.name, 'var', moving_variance_content)
 
             else:
@@ -277,8 +311,7 @@ class TensorflowParser2(Parser):
                 son = self.get_son(Rsqrt.name, [0, 0], True)
                 gamma_from = self.get_parent(son.name, [1, 1], True)
                 gamma = self.check_const(gamma_from)
-                gamma_tensor = gamma.get_attr('value')
-                scale = tensor_util.MakeNdarray(gamma_tensor)
+                scale = self._get_const_value(gamma)
                 self.set_weight(source_node.name, 'scale', scale)
                 output_node = self.get_son(source_node.name, [0, 0, 0, 0], True)
                 if output_node.type == 'Sub':
@@ -288,14 +321,14 @@ class TensorflowParser2(Parser):
                     Mul = self.get_son(Rsqrt.name, [0, 1], True)
 
             # beta  (bias)
-            beta = self.get_parent(output_node.name, [1, 0, 0], True).get_attr('value')
-            bias = tensor_util.MakeNdarray(beta)
+            beta = self.get_parent(output_node.name, [1, 0, 0], True)
+            bias = self._get_const_value(beta)
             IR_node.attr['bias'].b = True
             self.set_weight(source_node.name, 'bias', bias)
 
             # moving mean (mean)
-            moving_mean = self.get_parent(Mul.name, [0, 0]).get_attr('value')
-            mean = tensor_util.MakeNdarray(moving_mean)
+            moving_mean = self.get_parent(Mul.name, [0, 0])
+            mean = self._get_const_value(moving_mean)
             self.set_weight(source_node.name, 'mean', mean)
 
             # input node
@@ -319,8 +352,7 @@ class TensorflowParser2(Parser):
         # beta
         output_node = self.get_son(source_node.name, [0, 0, 0, 0], True)
         beta = self.get_parent(output_node.name, [1, 0, 0, 0, 0, 1], True)
-        beta_tensor = beta.get_attr('value')
-        beta = tensor_util.MakeNdarray(beta_tensor)
+        beta = self._get_const_value(beta)
         self.set_weight(source_node.name, 'bias', beta)
 
 
@@ -328,8 +360,7 @@ class TensorflowParser2(Parser):
         IR_node.attr['scale'].b = True
         son = self.get_son(source_node.name, [0, 0, 0], True)
         gamma = self.get_parent(son.name, [1, 1, 0, 0, 0, 1], True)
-        gamma_tensor = gamma.get_attr('value')
-        scale = tensor_util.MakeNdarray(gamma_tensor)
+        scale = self._get_const_value(gamma)
         self.set_weight(source_node.name, 'scale', scale)
         # output_node = self.get_son(source_node.name, [0, 0, 0, 0], True)
 
@@ -376,28 +407,32 @@ class TensorflowParser2(Parser):
         elif value.int_val:
             value = value.int_val[0]
         else:
-            value = tensor_util.MakeNdarray(value).tolist()
+            value = self._get_const_value(source_node).tolist()
         kwargs = {'value': value}
         assign_IRnode_values(IR_node, kwargs)
 
 
     def gen_IR(self):
+        try:
+            for layer in self.src_graph.topological_sort:
+                current_node = self.src_graph.get_node(layer)
 
-        for layer in self.src_graph.topological_sort:
-            current_node = self.src_graph.get_node(layer)
+                if self._skip_node(current_node):
+                    continue
 
-            if self._skip_node(current_node):
-                continue
+                node_type = current_node.type
 
-            node_type = current_node.type
+                if hasattr(self, "rename_" + node_type):
 
-            if hasattr(self, "rename_" + node_type):
-
-                func = getattr(self, "rename_" + node_type)
-                func(current_node)
-            else:
+                    func = getattr(self, "rename_" + node_type)
+                    func(current_node)
+                else:
 
-                self.rename_UNKNOWN(current_node)
+                    self.rename_UNKNOWN(current_node)
+        finally:
+            # every weight is extracted, the mapping lives on in the weight views until they are saved
+            if self.graph_reader:
+                self.graph_reader.close()
 
 
     @staticmethod
@@ -497,8 +532,7 @@ class TensorflowParser2(Parser):
             return
 
 
-        bias_value = variable.get_attr('value')
-        bias = tensor_util.MakeNdarray(bias_value)
+        bias = self._get_const_value(variable)
 
         # assert variable.get_attr('_output_shapes')[0].dim[0].size == IR_node.attr['kernel_shape'].list.i[-1]
 
@@ -559,8 +593,7 @@ class TensorflowParser2(Parser):
 
 
         weight_node = self.src_graph.get_parent(source_node.name, [1])
-        weight = self.check_const(weight_node).get_attr('value')
-        weight_content = tensor_util.MakeNdarray(weight)
+        weight_content = self._get_const_value(self.check_const(weight_node))
         self.set_weight(source_node.name, 'weights', weight_content)
         assign_IRnode_values(IR_node, kwargs)
 
@@ -573,28 +606,24 @@ class TensorflowParser2(Parser):
 
         # moving variance (var) /read
         moving_variance = self.get_parent(source_node.name, [2])
-        tensor_variance = moving_variance.get_attr('value')
-        moving_variance_content = tensor_util.MakeNdarray(tensor_variance)
+        moving_variance_content = self._get_const_value(moving_variance)
         self.set_weight(source_node.name, 'var', moving_variance_content)
 
         # gamma (scale)
         gamma = self.get_parent(source_node.name, [4])
-        gamma_value = gamma.get_attr('value')
-        gamma = tensor_util.MakeNdarray(gamma_value)
+        gamma = self._get_const_value(gamma)
         self.set_weight(source_node.name, 'scale', gamma)
         IR_node.attr['scale'].b = True
 
         # beta  (bias)
         beta = self.get_parent(source_node.name, [3])
-        beta_value = beta.get_attr('value')
-        beta = tensor_util.MakeNdarray(beta_value)
+        beta = self._get_const_value(beta)
         self.set_weight(source_node.name, 'bias', beta)
         IR_node.attr['use_bias'].b = True
 
         # moving mean (mean)
         mean = self.get_parent(source_node.name, [1])
-        mean_value = mean.get_attr('value')
-        mean = tensor_util.MakeNdarray(mean_value)
+        mean = self._get_const_value(mean)
         self.set_weight(source_node.name, 'mean', mean)
 
     def rename_Placeholder(self, source_node):
@@ -878,8 +907,7 @@ class TensorflowParser2(Parser):
 
         # weights
         input_node_weight = self.src_graph.get_parent(source_node.name, [1])
-        tensor_content = self.check_const(input_node_weight).get_attr('value')
-        W = tensor_util.MakeNdarray(tensor_content)
+        W = self._get_const_value(self.check_const(input_node_weight))
 
         kwargs['kernel_shape'] = self.tensor_shape_to_list(input_node_weight.get_attr('_output_shapes'))[0]
 
@@ -934,9 +962,7 @@ class TensorflowParser2(Parser):
         IR_node = self._convert_identity_operation(source_node, end_idx=1)
         input_weight_node = self.src_graph.get_parent(source_node.name, [1])
         weightnode = self.check_const(input_weight_node)
-        weight_value = weightnode.get_attr('value')
-
-        weight = tensor_util.MakeNdarray(weight_value)
+        weight = self._get_const_value(weightnode)
         self.set_weight(source_node.name, 'weights', weight)
 
         units = source_node.layer.attr['_output_shapes'].list.shape[-1].dim[-1].size
@@ -950,8 +976,7 @@ class TensorflowParser2(Parser):
             TensorflowParser2._copy_and_reop(source_node, IR_node, 'FullyConnected')
             variable = self.tf_graph.get_node(add_node.in_edges[1]) #add_bias node
             biasnode = self.check_const(variable)
-            bias_value = biasnode.get_attr('value')
-            bias = tensor_util.MakeNdarray(bias_value)
+            bias = self._get_const_value(biasnode)
             self.set_weight(source_node.name, 'bias', bias)
             IR_node.attr['use_bias'].b = True
 
@@ -993,8 +1018,7 @@ class TensorflowParser2(Parser):
 
         # weights
         input_node = self.src_graph.get_parent(source_node.name, [1])
-        tensor_content = input_node.get_attr('value')
-        W = tensor_util.MakeNdarray(tensor_content)
+        W = self._get_const_value(input_node)
         W = W.astype(np.uint8)
 
         kwargs['kernel_shape'] = self.tensor_shape_to_list(input_node.get_attr('_output_shapes'))[0]
@@ -1080,7 +1104,6 @@ class TensorflowParser2(Parser):
             scalenode = None
 
         if scalenode:
-            scale_value = scalenode.get_attr('value')
             IR_node = self._convert_identity_operation(source_node, end_idx=1, new_op = 'BatchNorm')
             # for attr.shape >= 2
             for i in range(len(IR_node.attr["_output_shapes"].list.shape)-1):
@@ -1090,31 +1113,27 @@ class TensorflowParser2(Parser):
             # For models built by slim.batch_norm, remove duplicate BN (eg.facenet)
             return
 
-        scale = tensor_util.MakeNdarray(scale_value)
+        scale = self._get_const_value(scalenode)
         self.set_weight(source_node.name, 'scale', scale)
         IR_node.attr['scale'].b = True
 
 
         IR_node.attr['epsilon'].f = source_node.get_attr('epsilon', 0)
         biasnode = self.check_const(self.get_parent(source_node.name, [2], True))
-        if biasnode:
-            bias_value = biasnode.get_attr('value')
-        else:
+        if not biasnode:
             innode = self.get_parent(source_node.name, [2], True)
             name = innode.name.split(':')[0]
-            bias_value = self.check_const(self.src_graph.layer_map[name]).get_attr('value')
-        bias = tensor_util.MakeNdarray(bias_value)
+            biasnode = self.check_const(self.src_graph.layer_map[name])
+        bias = self._get_const_value(biasnode)
         self.set_weight(source_node.name, 'bias', bias)
         IR_node.attr['bias'].b = True
 
         meannode = self.check_const(self.get_parent(source_node.name, [3], True))
-        mean_value = meannode.get_attr('value')
-        mean = tensor_util.MakeNdarray(mean_value)
+        mean = self._get_const_value(meannode)
         self.set_weight(source_node.name, 'mean', mean)
 
         variancenode = self.check_const(self.get_parent(source_node.name, [4], True))
-        variance_value = variancenode.get_attr('value')
-        variance = tensor_util.MakeNdarray(variance_value)
+        variance = self._get_const_value(variancenode)
         self.set_weight(source_node.name, 'var', variance)
 
 
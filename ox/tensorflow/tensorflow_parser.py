@@ -10,11 +10,74 @@ import ox.common.IR.graph_pb2 as graph_pb2
 from ox.common.IR.graph_pb2 import NodeDef, GraphDef, DataType
 from ox.common.utils import *
 from ox.common.DataStructure.parser import Parser
+from ox.common.cache import DiskCache
 from tensorflow.tools.graph_transforms import TransformGraph
 from ox.rewriter.utils import *
+from ox.rewriter.pass_manager import PassManager
 import tempfile
 import os
 import shutil
+from collections.abc import Mapping
+
+
+class CheckpointData(Mapping):
+    """Read-only mapping from variable name to ndarray backed by an open checkpoint.
+
+    Tensors are only read from the checkpoint when they are looked up, so the
+    optimizer slots and counters that no converted layer refers to never leave
+    the disk. The "ExponentialMovingAverage" suffix is stripped from the names,
+    and the averaged value shadows the raw variable as before.
+    """
+
+    def __init__(self, model_weight_path):
+        self._reader = tensorflow.train.NewCheckpointReader(model_weight_path)
+        var_to_shape_map = self._reader.get_variable_to_shape_map()
+        var_to_dtype_map = self._reader.get_variable_to_dtype_map()
+
+        self._names = dict()
+        self._sizes = dict()
+        for name in sorted(var_to_shape_map):
+            name_seg = name.split("/")
+            if name_seg[-1] == "ExponentialMovingAverage":
+                self._names["/".join(name_seg[:-1])] = name
+            else:
+                self._names.setdefault(name, name)
+
+            itemsize = np.dtype(var_to_dtype_map[name].as_numpy_dtype).itemsize
+            self._sizes[name] = int(np.prod(var_to_shape_map[name])) * itemsize
+
+        self._cache = dict()
+        self.bytes_read = 0
+
+
+    @property
+    def bytes_total(self):
+        return sum(self._sizes.values())
+
+
+    def __getitem__(self, name):
+        if not name in self._cache:
+            ckpt_name = self._names[name]
+            self._cache[name] = self._reader.get_tensor(ckpt_name)
+            self.bytes_read += self._sizes[ckpt_name]
+        return self._cache[name]
+
+
+    def __contains__(self, name):
+        return name in self._names
+
+
+    def __iter__(self):
+        return iter(self._names)
+
+
+    def __len__(self):
+        return len(self._names)
+
+
+    def report(self):
+        print ("Tensorflow checkpoint: [%d] of [%d] variables read, %s of %s." % (
+            len(self._cache), len(self), sizeof_fmt(self.bytes_read), sizeof_fmt(self.bytes_total)))
 
 
 class TensorflowParser(Parser):
@@ -47,6 +110,11 @@ class TensorflowParser(Parser):
         "FIFOQueueV2"
     ])
 
+    transforms = ["fold_constants(ignore_errors=true)"]
+
+    # passes run on the TensorflowGraph
+    passes = ['tensorflow_rnn']
+
     dtype_map = {
         0  : graph_pb2.DT_UNDEFINED,
         1  : graph_pb2.DT_FLOAT32,
@@ -98,7 +166,7 @@ class TensorflowParser(Parser):
 
     @staticmethod
     def _load_weights(model_weight_path):
-        """Load a tensorflow checkpoint file from disk
+        """Open a tensorflow checkpoint file from disk
 
         Parameters
         ----------
@@ -107,19 +175,11 @@ class TensorflowParser(Parser):
 
         Returns
         -------
-        model: tensor name --> ndarry
+        model: tensor name --> ndarry, read from the checkpoint on first access
         """
-        reader = tensorflow.train.NewCheckpointReader(model_weight_path)
-        var_to_shape_map = reader.get_variable_to_shape_map()
-        data = dict()
-        for name in var_to_shape_map:
-            tensor = reader.get_tensor(name)
-            name_seg = name.split("/")
-            if name_seg[-1] == "ExponentialMovingAverage":
-                name = "/".join(name_seg[:-1])
-            data[name] = tensor
+        data = CheckpointData(model_weight_path)
 
-        print ("Tensorflow checkpoint file [%s] loaded successfully. [%d] variables loaded." % (model_weight_path, len(data)))
+        print ("Tensorflow checkpoint file [%s] opened successfully. [%d] variables found." % (model_weight_path, len(data)))
         return data
 
 
@@ -227,17 +287,26 @@ class TensorflowParser(Parser):
         output_node.real_name = source_node.name
 
 
-    def __init__(self, meta_file, checkpoint_file, dest_nodes, inputShape = None, in_nodes = None):
-        super(TensorflowParser, self).__init__()
+    @staticmethod
+    def _load_cached_graph(cache, cache_key):
+        from tensorflow.core.framework.graph_pb2 import GraphDef as TFGraphDef
 
+        data = cache.get(cache_key)
+        if data is None:
+            return None
+
+        model = TFGraphDef()
+        model.ParseFromString(data)
+        print ("Tensorflow transformed graph [%s] loaded from cache." % cache_key)
+        return model
+
+
+    @staticmethod
+    def _transform_graph(meta_file, dest_nodes, inputShape, in_nodes):
         # load model files into TensorFlow graph
         if meta_file:
             model = TensorflowParser._load_meta(meta_file)
 
-        if checkpoint_file:
-            self.ckpt_data = TensorflowParser._load_weights(checkpoint_file)
-            self.weight_loaded = True
-
         # extract subgraph using in_nodes and dest_nodes
         if in_nodes != None and inputShape != None:
             from tensorflow.python.tools import strip_unused_lib
@@ -253,9 +322,7 @@ class TensorflowParser(Parser):
             for i in range(len(inputShape)):
                 input_list.append(tensorflow.Dimension(inputShape[i]))
             tensor_input = tensorflow.TensorShape(input_list)
-            # Build network graph
-            self.tf_graph = TensorflowGraph(model)
-            for node in self.tf_graph.model.node:
+            for node in model.node:
                 if node.name in in_nodes:
                     node.attr['shape'].shape.CopyFrom(tensor_input.as_proto())
                     node.attr['_output_shapes'].list.shape.pop()  #unknown_rank pop
@@ -265,14 +332,6 @@ class TensorflowParser(Parser):
         elif dest_nodes != None:
             from tensorflow.python.framework.graph_util import extract_sub_graph
             model = extract_sub_graph(model, dest_nodes)
-            self.tf_graph = TensorflowGraph(model)
-
-        else:
-            self.tf_graph = TensorflowGraph(model)
-
-
-        # Graph Transform
-        transforms = ["fold_constants(ignore_errors=true)"]
 
         #  Get input node name
         if not in_nodes:
@@ -281,8 +340,9 @@ class TensorflowParser(Parser):
                 if node.op == 'Placeholder':
                     in_nodes.append(node.name)
 
+        # Graph Transform
         transformed_graph_def = TransformGraph(model, in_nodes,
-                                            dest_nodes, transforms)
+                                            dest_nodes, TensorflowParser.transforms)
         in_type_list = {}
         in_shape_list = {}
 
@@ -290,7 +350,7 @@ class TensorflowParser(Parser):
             if n.name in in_nodes:
                 in_type_list[n.name] = n.attr['dtype'].type
                 in_node_shape = n.attr['shape'].shape
-                in_node_shape_str = self._shapeToStr(in_node_shape)
+                in_node_shape_str = TensorflowParser._shapeToStr(in_node_shape)
                 in_shape_list[n.name] = in_node_shape_str
 
         dtype = tensorflow.float32
@@ -317,10 +377,44 @@ class TensorflowParser(Parser):
             model = meta_graph_def.graph_def
             shutil.rmtree(tempdir)
 
+        return model
+
+
+    def __init__(self, meta_file, checkpoint_file, dest_nodes, inputShape = None, in_nodes = None,
+                 cache_dir = None, cache_size = 4 * 1024 ** 3, passes = None, trace_memory = False):
+        super(TensorflowParser, self).__init__()
+
+        if checkpoint_file:
+            self.ckpt_data = TensorflowParser._load_weights(checkpoint_file)
+            self.weight_loaded = True
+
+        # the transformed graph only depends on the meta file and the conversion arguments
+        model = None
+        if cache_dir:
+            cache = DiskCache(cache_dir, cache_size)
+            cache_key = DiskCache.make_key(DiskCache.hash_file(meta_file), in_nodes, dest_nodes, inputShape,
+                                           TensorflowParser.transforms, tensorflow.__version__)
+            model = TensorflowParser._load_cached_graph(cache, cache_key)
+
+        if model is None:
+            model = TensorflowParser._transform_graph(meta_file, dest_nodes, inputShape, in_nodes)
+            if cache_dir:
+                cache.put(cache_key, model.SerializeToString())
+
         self.tf_graph = TensorflowGraph(model)
         self.tf_graph.build()
 
-        process_graph(self.tf_graph, self.ckpt_data)
+        self.pass_manager = PassManager(self.passes if passes is None else passes, trace_memory = trace_memory)
+        self.pass_manager.run(self.tf_graph, self.ckpt_data)
+        self.pass_manager.report()
+
+
+    def run(self, dest_path):
+        op_sets = super(TensorflowParser, self).run(dest_path)
+        if self.weight_loaded:
+            self.ckpt_data.report()
+
+        return op_sets
 
     @classmethod
     def _skip_node(cls, source_node):
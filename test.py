@@ -179,7 +179,7 @@ def tensorflow(test_models, model_path, img_path):
         converted_file = os.path.join(model_path, 'tensorflow', model, model+'_ox')
 
         emitter = TensorflowEmitter((arch_filename, weight_filename))
-        emitter.run(converted_file + '.py', None, 'test')
+        emitter.run(converted_file + '.py', converted_file + '.npy', 'test')
 
         # test model
         if 'resnet' in model:
@@ -191,7 +191,7 @@ def tensorflow(test_models, model_path, img_path):
         if 'lstm' in model:
             x = np.reshape(x, (-1, 224 * 224 * 3))
 
-        model_converted = imp.load_source('TFModel', converted_file + '.py').KitModel(weight_filename)
+        model_converted = imp.load_source('TFModel', converted_file + '.py').KitModel(converted_file + '.npy')
 
         input_tf, model_tf = model_converted
 
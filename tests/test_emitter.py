@@ -0,0 +1,20 @@
+from ox.common.DataStructure.emitter import Emitter
+
+
+class _Emitter(Emitter):
+    passes = ['fold_constants', 'eliminate_dead_nodes', 'fuse_activations', 'infer_shapes', 'fold_scopes']
+
+
+def test_default_passes():
+    assert _Emitter()._get_passes() == _Emitter.passes
+
+
+def test_fold_batchnorm_runs_before_fuse_activations():
+    passes = _Emitter()._get_passes(fold_batchnorm = True)
+    assert passes == ['fold_constants', 'eliminate_dead_nodes', 'fold_batchnorm', 'fuse_activations', 'infer_shapes', 'fold_scopes']
+    assert _Emitter.passes == ['fold_constants', 'eliminate_dead_nodes', 'fuse_activations', 'infer_shapes', 'fold_scopes']
+
+
+def test_fold_batchnorm_with_given_passes():
+    assert _Emitter()._get_passes(['fold_constants'], True) == ['fold_constants', 'fold_batchnorm']
+    assert _Emitter()._get_passes(['fold_batchnorm', 'infer_shapes'], True) == ['fold_batchnorm', 'infer_shapes']
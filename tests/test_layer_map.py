@@ -0,0 +1,44 @@
+from ox.common.DataStructure.graph import LayerMap
+
+
+class _Node(object):
+
+    def __init__(self, node_type):
+        self.type = node_type
+
+
+def _layer_map():
+    return LayerMap([('a', _Node('Conv')), ('b', _Node('Relu')), ('c', _Node('Conv')), ('d', _Node('Conv'))])
+
+
+def test_names_by_type_in_insertion_order():
+    layer_map = _layer_map()
+    assert layer_map.get_names_by_type(['Conv']) == ['a', 'c', 'd']
+    assert layer_map.get_names_by_type(['Relu', 'Conv']) == ['a', 'b', 'c', 'd']
+
+
+def test_set_again_keeps_order():
+    layer_map = _layer_map()
+    layer_map['a'] = layer_map['a']
+    layer_map['c'] = _Node('Conv')
+    assert layer_map.get_names_by_type(['Conv']) == ['a', 'c', 'd']
+
+
+def test_reindex_keeps_order_and_moves_retyped_nodes():
+    layer_map = _layer_map()
+    layer_map['c'].type = 'Relu'
+    layer_map.reindex()
+    assert layer_map.get_names_by_type(['Conv']) == ['a', 'd']
+    assert layer_map.get_names_by_type(['Relu']) == ['b', 'c']
+
+
+def test_dict_methods_update_the_index():
+    layer_map = _layer_map()
+    assert layer_map.pop('a').type == 'Conv'
+    assert layer_map.popitem()[0] == 'd'
+    layer_map.setdefault('e', _Node('Conv'))
+    layer_map.update({'f' : _Node('Relu')})
+    assert layer_map.get_names_by_type(['Conv']) == ['c', 'e']
+    assert layer_map.get_names_by_type(['Relu']) == ['b', 'f']
+    layer_map.clear()
+    assert layer_map.get_names_by_type(['Conv', 'Relu']) == []
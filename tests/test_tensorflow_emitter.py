@@ -0,0 +1,94 @@
+import re
+
+import numpy as np
+import pytest
+
+import ox.common.IR.graph_pb2 as graph_pb2
+from ox.common.utils import list_to_shape
+from ox.tensorflow.tensorflow_emitter import TensorflowEmitter
+
+
+def _add_node(graph, name, op, inputs, shape):
+    node = graph.node.add()
+    node.name = name
+    node.op = op
+    node.input.extend(inputs)
+    node.attr['_output_shapes'].list.shape.extend([list_to_shape(shape)])
+    return node
+
+
+def _convert(path):
+    """IR of relu(conv(x) + bias) + (a + b), as written by a parser."""
+    model = graph_pb2.ModelDef()
+    graph = model.graph
+
+    data = _add_node(graph, 'x', 'DataInput', [], [-1, 4, 4, 2])
+    data.attr['shape'].shape.CopyFrom(list_to_shape([-1, 4, 4, 2]))
+    data.attr['dtype'].type = graph_pb2.DT_FLOAT32
+    conv = _add_node(graph, 'conv', 'Conv', ['x'], [-1, 4, 4, 3])
+    conv.attr['kernel_shape'].list.i.extend([3, 3, 2, 3])
+    conv.attr['strides'].list.i.extend([1, 1, 1, 1])
+    conv.attr['auto_pad'].s = b'SAME_UPPER'
+    conv.attr['group'].i = 1
+    for name in ('bias', 'a', 'b'):
+        _add_node(graph, name, 'Constant', [], [3]).attr['dtype'].type = graph_pb2.DT_FLOAT32
+    _add_node(graph, 'conv_bias', 'Add', ['conv', 'bias'], [-1, 4, 4, 3])
+    _add_node(graph, 'relu', 'Relu', ['conv_bias'], [-1, 4, 4, 3])
+    _add_node(graph, 'offset', 'Add', ['a', 'b'], [3])
+    _add_node(graph, 'y', 'Add', ['relu', 'offset'], [-1, 4, 4, 3])
+
+    rng = np.random.RandomState(0)
+    weights = {
+        'conv' : {'weights' : rng.randn(3, 3, 2, 3).astype(np.float32)},
+        'bias' : {'value' : rng.randn(3).astype(np.float32)},
+        'a'    : {'value' : rng.randn(3).astype(np.float32)},
+        'b'    : {'value' : rng.randn(3).astype(np.float32)},
+    }
+    with open(path + '.pb', 'wb') as f:
+        f.write(model.SerializeToString())
+    np.save(path + '.npy', weights)
+    return weights
+
+
+def _reference(weights, x):
+    padded = np.pad(x, [(0, 0), (1, 1), (1, 1), (0, 0)], 'constant')
+    kernel = weights['conv']['weights']
+    out = np.zeros(x.shape[:3] + (kernel.shape[-1],), np.float32)
+    for i in range(x.shape[1]):
+        for j in range(x.shape[2]):
+            out[:, i, j] = np.tensordot(padded[:, i : i + 3, j : j + 3], kernel, axes = 3)
+    out = np.maximum(out + weights['bias']['value'], 0)
+    return out + weights['a']['value'] + weights['b']['value']
+
+
+def test_convert_emit_load(tmp_path):
+    IR_file = str(tmp_path / 'model')
+    converted_file = str(tmp_path / 'converted')
+    weights = _convert(IR_file)
+
+    emitter = TensorflowEmitter((IR_file + '.pb', IR_file + '.npy'))
+    emitter.run(converted_file + '.py', converted_file + '.npy', 'test')
+
+    # the bias is fused into the conv, the emitter's weights have it and the IR ones are untouched
+    converted_weights = np.load(converted_file + '.npy', allow_pickle = True).item()
+    np.testing.assert_array_equal(converted_weights['conv']['bias'], weights['bias']['value'])
+    assert not 'bias' in np.load(IR_file + '.npy', allow_pickle = True).item()['conv']
+
+    # every weight read by the generated code is in the weights it is loaded with
+    with open(converted_file + '.py') as f:
+        code = f.read()
+    for name in re.findall(r"__weights_dict\['([^']+)'\]", code):
+        assert name in converted_weights
+
+    tf = pytest.importorskip('tensorflow')
+    if not hasattr(tf, 'placeholder'):
+        pytest.skip('the generated code needs the TensorFlow 1.x API')
+    import imp
+    model_converted = imp.load_source('TFModel', converted_file + '.py').KitModel(converted_file + '.npy')
+    input_tf, model_tf = model_converted
+
+    x = np.random.RandomState(1).randn(2, 4, 4, 2).astype(np.float32)
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        predict = sess.run(model_tf, feed_dict = {input_tf : x})
+    np.testing.assert_allclose(predict, _reference(weights, x), rtol = 1e-4, atol = 1e-5)